@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""An array backed Shape.
+
+This module needs numpy. The rest of polygon2square does not, so it is only
+imported by code that asks for an ArrayShape.
+"""
+
+from collections import defaultdict
+
+import numpy as np
+
+from geometry import (PRECISION, SHAPE_STATS, Shape, Triangle, affine_compose,
+                      convex_hull, transform_hull)
+
+# The two other points of a triangle, in order, for each point of a triangle
+_OTHERS = np.array([[1, 2], [0, 2], [0, 1]])
+
+def _edge_intersections(points, values, u, v):
+    """Return where the line crosses the edge from point u to point v of
+    every triangle, given the value of the line equation at every point."""
+    rows = np.arange(len(points))
+    pu, pv = points[rows, u], points[rows, v]
+    vu, vv = values[rows, u], values[rows, v]
+    t = (vu / (vu - vv))[:, np.newaxis]
+    return pu + t * (pv - pu)
+
+def _ordered(pieces):
+    """Concatenate (keys, triangles) pairs and sort the triangles by key, so
+    that the pieces of a split come out in the same order as the triangles
+    they were cut from."""
+    keys = np.concatenate([k for k, t in pieces])
+    triangles = np.concatenate([t for k, t in pieces])
+    return triangles[np.argsort(keys, kind='stable')]
+
+def split_triangles(array, line):
+    """Splits an (N, 3, 2) array of triangles into two arrays separated by
+    line.
+
+    This does the same as calling Triangle.split on every triangle, but
+    classifies all the points against the line at once and then builds the
+    triangles for each of the cases in Triangle.split with masks. Returns the
+    triangles on the non-negative side and on the non-positive side.
+    """
+    if len(array) == 0:
+        return (array, array)
+    values = line.A * array[..., 0] + line.B * array[..., 1] + line.C
+    # Points less than PRECISION away from the line are on it, like
+    # Line.side_of_line (but without its exact fallback)
+    tolerance = PRECISION * np.hypot(line.A, line.B)
+    sides = np.where(np.abs(values) < tolerance, 0, np.sign(values))
+    sides = sides.astype(np.int8)
+    npos = (sides == 1).sum(axis=1)
+    nneg = (sides == -1).sum(axis=1)
+    index = np.arange(len(array)) * 2
+    up = list()
+    down = list()
+
+    # The whole triangle is on one side of the line, or the line is "tangent"
+    # to the triangle
+    whole_up = (npos > 0) & (nneg == 0)
+    whole_down = npos == 0
+    up.append((index[whole_up], array[whole_up]))
+    down.append((index[whole_down], array[whole_down]))
+
+    # The triangle is cut into two, on one vertex
+    vertex_cut = (npos == 1) & (nneg == 1)
+    if vertex_cut.any():
+        s, p, v = sides[vertex_cut], array[vertex_cut], values[vertex_cut]
+        zero, pos, neg = [np.argmax(s == i, axis=1) for i in (0, 1, -1)]
+        rows = np.arange(len(p))
+        basepoint = _edge_intersections(p, v, pos, neg)
+        pos_tri = np.stack((basepoint, p[rows, zero], p[rows, pos]), axis=1)
+        neg_tri = np.stack((basepoint, p[rows, zero], p[rows, neg]), axis=1)
+        up.append((index[vertex_cut], pos_tri))
+        down.append((index[vertex_cut], neg_tri))
+
+    # Line intersects two segments
+    edge_cut = (npos > 0) & (nneg > 0) & (npos + nneg == 3)
+    if edge_cut.any():
+        s, p, v = sides[edge_cut], array[edge_cut], values[edge_cut]
+        keys = index[edge_cut]
+        lone_up = (s == 1).sum(axis=1) == 1
+        lone = np.where(lone_up, np.argmax(s == 1, axis=1),
+                        np.argmax(s == -1, axis=1))
+        a, b = _OTHERS[lone, 0], _OTHERS[lone, 1]
+        rows = np.arange(len(p))
+        i0 = _edge_intersections(p, v, b, lone)
+        i1 = _edge_intersections(p, v, a, lone)
+        t1 = np.stack((p[rows, lone], i0, i1), axis=1)
+        t2 = np.stack((p[rows, a], i0, i1), axis=1)
+        t3 = np.stack((p[rows, a], p[rows, b], i0), axis=1)
+        lone_down = ~lone_up
+        up.append((keys[lone_up], t1[lone_up]))
+        up.append((keys[lone_down], t2[lone_down]))
+        up.append((keys[lone_down] + 1, t3[lone_down]))
+        down.append((keys[lone_down], t1[lone_down]))
+        down.append((keys[lone_up], t2[lone_up]))
+        down.append((keys[lone_up] + 1, t3[lone_up]))
+
+    return (_ordered(up), _ordered(down))
+
+class ArrayShape(Shape):
+    """A Shape that keeps all of its triangles in one (N, 3, 2) float64 array.
+
+    ArrayShape has the same interface as Shape, but translate, rotate, area,
+    bounding_box and vertices work on the whole array at once instead of
+    looping over every point in Python. The triangles attribute is still
+    available (as a list of Triangles) for code that needs it, but it is only
+    built when it is asked for. Like Shape, rotations and translations are
+    composed into a pending transform which is applied to the whole array when
+    the coordinates are needed.
+
+    Like Shape, this object should be treated as an immutable data structure.
+    """
+
+    def __init__(self, triangle_list, transform=None):
+        """triangle_list is a list of triangles or an (N, 3, 2) array,
+        transform is an affine transform still to be applied to them"""
+        if isinstance(triangle_list, np.ndarray):
+            array = triangle_list
+        else:
+            array = [t.points for t in triangle_list]
+        self._array = np.asarray(array, dtype=np.float64).reshape(-1, 3, 2)
+        self._transform = transform
+        self._transformed = None
+        self._triangles = None
+        self._convex_hull = None
+
+    @property
+    def array(self):
+        """The (N, 3, 2) array of triangles with any pending transform
+        applied"""
+        if self._transform is None:
+            return self._array
+        if self._transformed is None:
+            a, b, c, d, e, f = self._transform
+            linear = np.array([[a, d], [b, e]])
+            self._transformed = self._array @ linear + np.array([c, f])
+        return self._transformed
+
+    @property
+    def triangles(self):
+        """A list of Triangles, built from the array when first needed"""
+        if self._triangles is None:
+            self._triangles = [Triangle(tuple(tuple(p) for p in t))
+                               for t in self.array.tolist()]
+        return self._triangles
+
+    def split(self, line):
+        """Splits the Shape into two shapes separated by line.
+
+        All the points of the first shape will be on the non-negative side of
+        line. All the points of the second shape will be on the non-positive
+        side of the line.
+        """
+        SHAPE_STATS['split'] += 1
+        up, down = split_triangles(self.array, line)
+        return (ArrayShape(up), ArrayShape(down))
+
+    def __len__(self):
+        """Return the number of triangles in the shape"""
+        return len(self._array)
+
+    def __add__(self, other):
+        """Return a new ArrayShape containing the triangles of both shapes"""
+        if isinstance(other, ArrayShape):
+            other_array = other.array
+        else:
+            other_array = ArrayShape(other.triangles).array
+        shape = ArrayShape(np.concatenate((self.array, other_array)))
+        if self._convex_hull is not None and other._convex_hull is not None:
+            shape._convex_hull = convex_hull(self._convex_hull
+                                             + other._convex_hull)
+        return shape
+
+    def transform(self, matrix):
+        """Return a new ArrayShape transformed by the affine transform matrix.
+
+        This runs in O(1), the transform is composed with the pending one.
+        """
+        shape = ArrayShape(self._array, matrix if self._transform is None
+                           else affine_compose(matrix, self._transform))
+        if self._convex_hull is not None:
+            shape._convex_hull = transform_hull(self._convex_hull, matrix)
+        return shape
+
+    def area(self):
+        """Return the area of the shape"""
+        a = self._array
+        d1 = a[:, 1] - a[:, 0]
+        d2 = a[:, 2] - a[:, 0]
+        cross = d1[:, 0] * d2[:, 1] - d2[:, 0] * d1[:, 1]
+        area = float(0.5 * np.abs(cross).sum())
+        if self._transform is not None:
+            a, b, c, d, e, f = self._transform
+            area *= abs(a*e - b*d)
+        return area
+
+    def convex_hull(self):
+        """Return the convex hull of the shape (see geometry.convex_hull).
+
+        The result is cached like Shape.convex_hull.
+        """
+        SHAPE_STATS['hull'] += 1
+        if self._convex_hull is None:
+            points = np.unique(self.array.reshape(-1, 2), axis=0)
+            self._convex_hull = convex_hull(list(map(tuple, points.tolist())))
+        else:
+            SHAPE_STATS['hull_cached'] += 1
+        return self._convex_hull
+
+    def bounding_box(self):
+        """Return the axis aligned bounding box of the shape as a pair of
+        points (min_x, min_y), (max_x, max_y)"""
+        points = self.array.reshape(-1, 2)
+        low, high = points.min(axis=0), points.max(axis=0)
+        return ((float(low[0]), float(low[1])), (float(high[0]), float(high[1])))
+
+    def vertices(self):
+        """Return unique vertices inside this shape, sorted by x and then y
+        (the order of point_cmp, except for points with nearly equal x).
+
+        This gives the same points as Shape.vertices: a point that is equal
+        within PRECISION to a point kept before it (in the order of the
+        triangles) is left out. Exact copies are removed with np.unique, and
+        the pairs of equal points are found all at once, among the points
+        in neighbouring cells PRECISION wide (like in a VertexTable). Only
+        the points of those pairs, which are rare, are checked one by one.
+        """
+        points = self.array.reshape(-1, 2)
+        if len(points) == 0:
+            return []
+        points, first = np.unique(points, axis=0, return_index=True)
+        points = points[np.argsort(first)]
+        # Number the cells so that the numbers are sorted like the cells
+        cells = np.floor(points / PRECISION).astype(np.int64)
+        low = cells.min(axis=0) - 1
+        span = cells[:, 1].max() - low[1] + 2
+        keys = (cells[:, 0] - low[0]) * span + cells[:, 1] - low[1]
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        pairs = list()
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                wanted = keys + dx * span + dy
+                start = np.searchsorted(sorted_keys, wanted, 'left')
+                counts = np.searchsorted(sorted_keys, wanted, 'right') - start
+                # Every point paired with every point in the cell
+                i = np.repeat(np.arange(len(points)), counts)
+                offsets = np.arange(len(i)) - np.repeat(
+                    np.cumsum(counts) - counts, counts)
+                j = order[np.repeat(start, counts) + offsets]
+                # Only points that came before can be snapped to
+                close = (j < i) & (np.abs(points[i] - points[j])
+                                   < PRECISION).all(axis=1)
+                pairs.append(np.stack((i[close], j[close]), axis=1))
+        pairs = np.concatenate(pairs)
+        keep = np.ones(len(points), dtype=bool)
+        earlier = defaultdict(list)
+        for i, j in pairs.tolist():
+            earlier[i].append(j)
+        for i in sorted(earlier):
+            keep[i] = not keep[earlier[i]].any()
+        points = points[keep]
+        points = points[np.lexsort((points[:, 1], points[:, 0]))]
+        return list(map(tuple, points.tolist()))
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""Squarify many polygons without the GUI.
+
+Polygons are read one per line from the given files (or stdin), either as
+JSON or as WKT. A JSON line is a list of [x, y] points or an object with a
+"polygon" key holding such a list (and optionally an "id"). A WKT line is a
+POLYGON; only its outer ring is used.
+
+For every polygon one JSON line is written with its id and either the final
+dissection ("triangles") or every frame ("frames"). A frame is a list of
+pieces and a piece is a list of triangles, each a list of three [x, y]
+points (with --consolidate, also convex polygons with more points). Frames
+are written to a temporary file as they are made, so a polygon with many
+frames does not need them all in memory. Polygons that cannot be squarified
+get an "error" instead.
+
+With --cache DIR the final dissections are made from the dissection plans
+(see resultcache) of earlier polygons of the same shape where there are any.
+
+Example:
+
+    ./batchsquarify.py --jobs 8 polygons.jsonl > squares.jsonl
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import traceback
+from multiprocessing import Pool
+
+import polygongeometry as pg
+from resultcache import ResultCache
+
+def parse_wkt(text):
+    """Return the outer ring of a WKT POLYGON as a list of points"""
+    match = re.match(r'\s*POLYGON\s*\(\s*\(([^)]*)\)', text, re.IGNORECASE)
+    if match is None:
+        raise ValueError('Not a WKT POLYGON: ' + text.strip()[:40])
+    points = [tuple(float(c) for c in p.split()[:2])
+              for p in match.group(1).split(',')]
+    if len(points) > 1 and points[0] == points[-1]:
+        points.pop()
+    return points
+
+def parse_line(line, number, fmt='auto'):
+    """Return (id, polygon) for a line of input"""
+    line = line.strip()
+    if fmt == 'wkt' or (fmt == 'auto' and not line.startswith(('[', '{'))):
+        return number, parse_wkt(line)
+    data = json.loads(line)
+    if isinstance(data, dict):
+        return data.get('id', number), [tuple(p) for p in data['polygon']]
+    return number, [tuple(p) for p in data]
+
+def read_polygons(paths, fmt='auto'):
+    """Generate (id, polygon, error) triples from the files in paths ('-' is
+    stdin). Polygons without an id are numbered from 0 in the order they are
+    read. A line that cannot be parsed gives its number, None and the error
+    message, so that it gets an error entry like a polygon that cannot be
+    squarified."""
+    number = 0
+    for path in paths:
+        f = sys.stdin if path == '-' else open(path)
+        try:
+            for line in f:
+                if line.strip() and not line.lstrip().startswith('#'):
+                    try:
+                        polygon_id, polygon = parse_line(line, number, fmt)
+                    except Exception as e:
+                        yield number, None, error_message(e)
+                    else:
+                        yield polygon_id, polygon, None
+                    number += 1
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+def piece_triangles(piece):
+    """Return the triangles (or polygons) of a piece (Shape or Triangle) as
+    lists of points"""
+    triangles = piece.triangles if isinstance(piece, pg.Shape) else [piece]
+    return [[list(p) for p in t.points] for t in triangles]
+
+def frame_to_json(frame):
+    """Return a frame as a list of pieces"""
+    return [piece_triangles(piece) for piece in frame]
+
+def error_message(e):
+    """Return the message of an exception for the "error" of a result"""
+    return ''.join(traceback.format_exception_only(type(e), e)).strip()
+
+def output_name(polygon_id):
+    """Return the file name of the result of polygon_id in the output
+    directory. An id that is not a safe file name (one with a path
+    separator, say) is replaced by a hash of it."""
+    name = str(polygon_id)
+    if not re.fullmatch(r'[\w-][\w.-]{0,99}', name):
+        name = 'id-' + hashlib.sha1(name.encode()).hexdigest()
+    return name + '.json'
+
+def spool_frames(polygon_id, polygon, options, directory=None):
+    """Write the result with every frame of squarifying polygon to a
+    temporary file in directory (the default temporary directory if None)
+    and return {'id': polygon_id, 'spool': path}.
+
+    Every frame is written as soon as it is made, so the frames are never
+    all in memory. The file is removed if squarifying fails.
+    """
+    fd, path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write('{"id": %s, "frames": [' % json.dumps(polygon_id))
+            last = None
+            for i, frame in pg.iter_frames(polygon, **options):
+                if last is not None:
+                    f.write(', ')
+                json.dump(frame_to_json(frame), f)
+                last = frame
+            if not last:
+                raise ValueError('Polygon has fewer than three points')
+            f.write(']}')
+    except BaseException:
+        os.remove(path)
+        raise
+    return {'id': polygon_id, 'spool': path}
+
+def write_result(result, f):
+    """Write a result to the file f, moving the frames of a spooled result
+    (see spool_frames) over in blocks"""
+    if 'spool' in result:
+        with open(result['spool']) as spool:
+            shutil.copyfileobj(spool, f)
+    else:
+        json.dump(result, f)
+
+def discard_result(result):
+    """Remove the file of a spooled result, if there is one"""
+    if 'spool' in result:
+        try:
+            os.remove(result['spool'])
+        except FileNotFoundError:
+            pass
+
+# The result cache of this process (see squarify)
+_caches = dict()
+
+# The counters of a ResultCache that squarify hands back with its result
+CACHE_COUNTS = ('hits', 'misses', 'evictions')
+
+def squarify(job):
+    """Squarify one polygon and return the JSON result for it.
+
+    job is a tuple (id, polygon, error, all_frames, options, cache, spool)
+    where error is the message of a line that could not be parsed (or None),
+    options are passed to iter_frames (or final_frame, if only the final
+    dissection is written), cache is the directory of a ResultCache to take
+    the final dissection from, or None, and spool is the directory that
+    every frame is written to (see spool_frames), or None for the default
+    temporary directory.
+
+    When the cache is used, the result has a 'cache_counts' dict with the
+    number of hits, misses and evictions it took, which the caller should
+    remove before writing the result, because the caches of the processes of
+    a Pool can not be seen from the process that started it.
+    """
+    polygon_id, polygon, error, all_frames, options, cache, spool = job
+    if error is not None:
+        return {'id': polygon_id, 'error': error}
+    result = {'id': polygon_id}
+    counts = None
+    try:
+        if all_frames:
+            return spool_frames(polygon_id, polygon, options, spool)
+        elif cache is not None:
+            if cache not in _caches:
+                _caches[cache] = ResultCache(cache)
+            before = _caches[cache].stats
+            try:
+                last = _caches[cache].plan(polygon, **options).square()
+            finally:
+                after = _caches[cache].stats
+                counts = {k: after[k] - before[k] for k in CACHE_COUNTS}
+        else:
+            n, last = pg.final_frame(polygon, **options)
+        if not last:
+            raise ValueError('Polygon has fewer than three points')
+        result['triangles'] = [t for piece in frame_to_json(last)
+                               for t in piece]
+    except Exception as e:
+        result = {'id': polygon_id, 'error': error_message(e)}
+    if counts is not None:
+        result['cache_counts'] = counts
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Squarify polygons without the GUI.')
+    parser.add_argument('inputs', nargs='*', default=['-'],
+                        help='files of polygons, one per line (default stdin)')
+    parser.add_argument('--format', choices=['auto', 'json', 'wkt'],
+                        default='auto', help='the format of the input lines')
+    parser.add_argument('--frames', choices=['final', 'all'], default='final',
+                        help='write only the final dissection or every frame')
+    parser.add_argument('--output', metavar='DIR',
+                        help='write one <id>.json file per polygon into DIR '
+                        'instead of JSON lines to stdout (ids that are not '
+                        'safe file names are hashed)')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='the number of polygons to squarify at once')
+    parser.add_argument('--merge-strategy', choices=['sequential', 'balanced'],
+                        default='sequential')
+    parser.add_argument('--rectangle-strategy',
+                        choices=sorted(pg.RECTANGLE_STRATEGIES),
+                        default='squish',
+                        help="'strips' keeps the piece count down for long, "
+                        "thin triangles")
+    parser.add_argument('--consolidate', action='store_true',
+                        help='join the triangles of every piece into convex '
+                        'polygons between stages')
+    parser.add_argument('--cache', metavar='DIR',
+                        help='reuse the dissections of polygons of the same '
+                        'shape, kept in DIR (only with --frames final)')
+    args = parser.parse_args(argv)
+
+    options = {'merge_strategy': args.merge_strategy,
+               'rectangle_strategy': args.rectangle_strategy,
+               'consolidate': args.consolidate}
+    # With --output, frames are spooled next to their output file, so the
+    # spooled file can be renamed into place
+    jobs = ((i, p, e, args.frames == 'all', options, args.cache, args.output)
+            for i, p, e in read_polygons(args.inputs, args.format))
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    pool = Pool(args.jobs) if args.jobs > 1 else None
+    results = pool.imap(squarify, jobs, chunksize=4) if pool else map(squarify, jobs)
+    failed = 0
+    cache_counts = None
+    try:
+        for result in results:
+            counts = result.pop('cache_counts', None)
+            if counts is not None:
+                if cache_counts is None:
+                    cache_counts = dict.fromkeys(CACHE_COUNTS, 0)
+                for k in CACHE_COUNTS:
+                    cache_counts[k] += counts[k]
+            failed += 'error' in result
+            if args.output:
+                path = os.path.join(args.output, output_name(result['id']))
+                try:
+                    if 'spool' in result:
+                        os.replace(result['spool'], path)
+                    else:
+                        with open(path, 'w') as f:
+                            json.dump(result, f)
+                except OSError as e:
+                    discard_result(result)
+                    # The error entry goes to stdout, which is not used
+                    # otherwise
+                    failed += 'error' not in result
+                    json.dump({'id': result['id'], 'error': error_message(e)},
+                              sys.stdout)
+                    sys.stdout.write('\n')
+            else:
+                try:
+                    write_result(result, sys.stdout)
+                finally:
+                    discard_result(result)
+                sys.stdout.write('\n')
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    if failed:
+        print('%d polygon(s) could not be squarified' % failed, file=sys.stderr)
+    if cache_counts is not None:
+        print('cache: %(hits)d hits, %(misses)d misses, %(evictions)d '
+              'evictions' % cache_counts, file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""Benchmarks for squaring polygons.
+
+Polygons of every kind in GENERATORS are made for every size, with a fixed
+seed so that every run (and every version of the code) squares the same
+polygons. Every polygon is squared twice, reading the frames of a FrameList
+one after the other:
+
+  * once for the statistics of every stage (see FrameList.stats): the wall
+    time, the number of frames, triangles (and polygons, see FrameList's
+    consolidate option), splits and hulls, and for the frames per second
+    that FrameList.__getitem__ gives,
+  * once for the peak memory allocated in every stage, with tracemalloc
+    (which slows everything down).
+
+The results are written as JSON, so that runs of two versions can be
+compared. Polygons that cannot be squared get an "error" with the stage it
+happened in.
+
+Example:
+
+    ./benchmark.py --sizes 10 100 --output before.json
+"""
+
+import argparse
+import json
+import math
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import polygongeometry as pg
+from triangulation import random_polygon
+
+def convex_polygon(n, seed):
+    """Return a random convex polygon with n points on a circle"""
+    rng = random.Random(seed)
+    angles = sorted(rng.uniform(0, 2 * math.pi) for i in range(n))
+    return [(1000 * math.cos(a), 1000 * math.sin(a)) for a in angles]
+
+def star_polygon(n, seed):
+    """Return a random star shaped polygon (see triangulation.random_polygon)"""
+    return random_polygon(n, seed)
+
+def comb_polygon(n, seed):
+    """Return a comb with random length teeth and about n points"""
+    rng = random.Random(seed)
+    teeth = max(1, (n - 2) // 4)
+    top = list()
+    for i in range(teeth):
+        length = rng.uniform(50, 500)
+        top.extend([(20 * i, 20), (20 * i, 20 + length),
+                    (20 * i + 10, 20 + length), (20 * i + 10, 20)])
+    return [(0, 0), (20 * teeth - 10, 0)] + top[::-1]
+
+def sliver_polygon(n, seed):
+    """Return a long, thin polygon with about n points, which triangulates
+    into slivers"""
+    rng = random.Random(seed)
+    k = max(2, n // 2)
+    xs = sorted(rng.uniform(0, 1000) for i in range(2 * k - 2))
+    bottom = [(0, 0)] + [(x, -rng.uniform(0, 2)) for x in xs[::2]] + [(1000, 0)]
+    top = [(x, 5 + rng.uniform(0, 2)) for x in xs[1::2]]
+    return bottom + top[::-1]
+
+GENERATORS = {'convex': convex_polygon, 'star': star_polygon,
+              'comb': comb_polygon, 'sliver': sliver_polygon}
+
+def run_stages(polygon, options, stage_hook=None):
+    """Square polygon, reading the frames of a FrameList in order.
+
+    Returns the stats of the FrameList (see FrameList.stats), the number of
+    frames per second and the error message if the polygon could not be
+    squared.
+    """
+    frames = pg.FrameList(polygon, stats=True, stage_hook=stage_hook,
+                          **options)
+    error = None
+    n = 0
+    start = time.perf_counter()
+    try:
+        while True:
+            frames[n]
+            n += 1
+    except IndexError:
+        pass
+    except Exception as e:
+        error = '%s: %s' % (type(e).__name__, e)
+    seconds = time.perf_counter() - start
+    return frames.stats, n / seconds if seconds > 0 else None, error
+
+def peak_memory(polygon, options):
+    """Return the peak memory allocated in every stage of squaring polygon,
+    measured with tracemalloc"""
+    peaks = list()
+    def stage_hook(stats):
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        peaks.append(peak)
+    tracemalloc.start()
+    try:
+        stats, fps, error = run_stages(polygon, options, stage_hook)
+        if len(peaks) < len(stats):
+            # The stage that failed never ended
+            peaks.append(tracemalloc.get_traced_memory()[1])
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+def benchmark(kind, n, seed, options):
+    """Return the results for one polygon"""
+    polygon = GENERATORS[kind](n, seed)
+    result = {'kind': kind, 'n': len(polygon), 'seed': seed}
+    stages, fps, error = run_stages(polygon, options)
+    for s, peak in zip(stages, peak_memory(polygon, options)):
+        s['peak_bytes'] = peak
+    result['stages'] = stages
+    result['seconds'] = sum(s['seconds'] for s in stages)
+    result['frames'] = sum(s['frames'] for s in stages)
+    result['frames_per_second'] = fps
+    if error is not None:
+        result['error'] = error
+        result['error_stage'] = stages[-1]['name']
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark squaring seeded random polygons.')
+    parser.add_argument('--kinds', nargs='+', choices=sorted(GENERATORS),
+                        default=sorted(GENERATORS))
+    parser.add_argument('--sizes', nargs='+', type=int,
+                        default=[10, 100, 1000, 10000],
+                        help='the numbers of points of the polygons')
+    parser.add_argument('--seeds', nargs='+', type=int, default=[0])
+    parser.add_argument('--output', metavar='FILE',
+                        help='write the JSON results to FILE instead of stdout')
+    parser.add_argument('--merge-strategy', choices=['sequential', 'balanced'],
+                        default='sequential')
+    parser.add_argument('--rectangle-strategy',
+                        choices=sorted(pg.RECTANGLE_STRATEGIES),
+                        default='squish')
+    parser.add_argument('--consolidate', action='store_true')
+    args = parser.parse_args(argv)
+
+    options = {'merge_strategy': args.merge_strategy,
+               'rectangle_strategy': args.rectangle_strategy,
+               'consolidate': args.consolidate}
+    results = list()
+    for kind in args.kinds:
+        for n in args.sizes:
+            for seed in args.seeds:
+                result = benchmark(kind, n, seed, options)
+                print('%-7s %6d %8.3fs %7d frames %s' % (
+                    kind, result['n'], result['seconds'], result['frames'],
+                    result.get('error', '')), file=sys.stderr)
+                results.append(result)
+    report = {'python': platform.python_version(),
+              'platform': platform.platform(),
+              'options': options,
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        sys.stdout.write('\n')
+
+if __name__ == '__main__':
+    main()
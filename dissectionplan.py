@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""Dissection plans.
+
+A dissection plan is what squaring a polygon comes down to, without the
+frames: the parts the polygon is cut into, in the coordinates of the
+polygon, and the rigid transform that moves every part to its place in the
+square. It takes O(parts) space.
+
+Cutting a polygon moved, rotated, reflected or uniformly scaled by a
+similarity transform S along the cuts of the polygon, moved by S, gives the
+parts of the transformed polygon, and S T S^-1 moves them into the
+transformed square (see DissectionPlan.transformed). So one plan serves
+every copy of a template polygon, without squaring it again.
+
+Example:
+
+    plan = dissection_plan(polygon)
+    square = plan.transformed(affine_translation((10, 0))).square()
+"""
+
+import math
+
+import polygongeometry as pg
+from geometry import (PRECISION, Polygon, Shape, Triangle, affine_apply,
+                      affine_compose, affine_inverse)
+
+class DissectionPlan:
+    """The parts of a polygon and the transforms that move them into a
+    square.
+
+    parts is a list of the parts of the polygon, each a tuple of points
+    (three for a triangle, more for a convex polygon), and transforms is a
+    list of the affine transforms (see geometry) that move them into the
+    square, one per part.
+
+    Like Shape, this object should be treated as an immutable data
+    structure.
+    """
+
+    def __init__(self, parts, transforms):
+        if len(parts) != len(transforms):
+            raise ValueError('Every part needs a transform')
+        self.parts = parts
+        self.transforms = transforms
+
+    def __len__(self):
+        """Return the number of parts"""
+        return len(self.parts)
+
+    def as_dict(self):
+        """Return the plan as a dict of lists, which can be written as
+        JSON"""
+        return {'parts': [[list(p) for p in part] for part in self.parts],
+                'transforms': [list(t) for t in self.transforms]}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Return the plan of a dict made by as_dict"""
+        return cls([tuple(tuple(p) for p in part) for part in data['parts']],
+                   [tuple(t) for t in data['transforms']])
+
+    def square(self):
+        """Return the parts moved into the square, as Triangles and
+        Polygons"""
+        pieces = list()
+        for part, matrix in zip(self.parts, self.transforms):
+            points = tuple(affine_apply(matrix, p) for p in part)
+            pieces.append(Triangle(points) if len(points) == 3
+                          else Polygon(points))
+        return pieces
+
+    def transformed(self, matrix):
+        """Return the plan of the polygon transformed by matrix.
+
+        matrix has to be a similarity transform (a rotation, reflection,
+        uniform scale and translation), so that the transforms of the parts
+        stay rigid. A reflection reverses the order of the points of every
+        part.
+        """
+        a, b, c, d, e, f = matrix
+        scale = math.hypot(a, d)
+        if (abs(math.hypot(b, e) - scale) > PRECISION * scale
+                or abs(a*b + d*e) > PRECISION * scale**2 or scale == 0):
+            raise ValueError('Not a similarity transform: ' + repr(matrix))
+        inverse = affine_inverse(matrix)
+        parts = [tuple(affine_apply(matrix, p) for p in part)
+                 for part in self.parts]
+        if a*e - b*d < 0:
+            parts = [part[::-1] for part in parts]
+        transforms = [affine_compose(matrix, affine_compose(t, inverse))
+                      for t in self.transforms]
+        return DissectionPlan(parts, transforms)
+
+def plan_from_frame(frame):
+    """Return the plan of the final frame of a FrameList that tracked the
+    origins of its pieces (see FrameList's track_origins)"""
+    parts = list()
+    transforms = list()
+    for piece in frame:
+        primitives = piece.triangles if isinstance(piece, Shape) else [piece]
+        for primitive in primitives:
+            if primitive.origin is None:
+                raise ValueError('The origins of the pieces were not tracked')
+            inverse = affine_inverse(primitive.origin)
+            parts.append(tuple(affine_apply(inverse, p)
+                               for p in primitive.points))
+            transforms.append(primitive.origin)
+    return DissectionPlan(parts, transforms)
+
+def dissection_plan(polygon, **options):
+    """Return the dissection plan of squaring polygon.
+
+    The polygon is squared in final mode (see polygongeometry.final_frame),
+    so none of the frames are built. options are passed on to FrameList.
+    """
+    n, frame = pg.final_frame(polygon, track_origins=True, **options)
+    return plan_from_frame(frame)
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""A binary file format for the frames of a dissection.
+
+A frame file keeps every piece once, as packed floats, and every frame as a
+list of piece ids, so that pieces shared by consecutive frames are not
+repeated. Offset tables at the end of the file give the position of every
+piece and every frame, so FrameFile can memory map the file and read any
+frame without reading the rest of it.
+
+The layout (all numbers are little endian) is:
+
+  * a header: MAGIC, the format version, the float type code ('d' for
+    float64 or 'f' for float32), the number of frames, the number of pieces
+    and the offsets of the piece table and the frame table,
+  * the pieces and frames, in the order they were written. A piece is its
+    kind (0 for a Triangle, 1 for a Shape), its number of primitives, the
+    number of points of every primitive (3 for a triangle, more for a
+    polygon) and then the x and y of every point. A frame is its number of
+    pieces and their ids,
+  * the piece table, with the offset of every piece (the id of a piece is
+    its position in the table),
+  * the frame table, with the offset of every frame.
+"""
+
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections import OrderedDict
+
+from geometry import Polygon, Shape, Triangle
+
+MAGIC = b'SQFRAMES'
+VERSION = 1
+
+_HEADER = struct.Struct('<8sIcxxxQQQQ')
+_PIECE = struct.Struct('<BI')
+_COUNT = struct.Struct('<I')
+_TRIANGLE, _SHAPE = 0, 1
+
+def _pack(typecode, values):
+    """Return values as little endian bytes of the array type typecode"""
+    a = array(typecode, values)
+    if sys.byteorder != 'little':
+        a.byteswap()
+    return a.tobytes()
+
+def _unpack(typecode, view):
+    """Return the little endian values in a memoryview as a sequence of the
+    array type typecode. No copy is made on little endian machines."""
+    if sys.byteorder == 'little':
+        return view.cast(typecode)
+    a = array(typecode, view)
+    a.byteswap()
+    return a
+
+def _encode_piece(piece, typecode):
+    """Return the bytes of a piece (a Shape or a Triangle)"""
+    if isinstance(piece, Shape):
+        kind, primitives = _SHAPE, piece.triangles
+    else:
+        kind, primitives = _TRIANGLE, [piece]
+    sizes = [len(p.points) for p in primitives]
+    coordinates = [c for p in primitives for point in p.points for c in point]
+    return b''.join((_PIECE.pack(kind, len(primitives)), _pack('I', sizes),
+                     _pack(typecode, coordinates)))
+
+def write_frames(path, frames, typecode='d'):
+    """Write frames (an iterable of frames, like a FrameList or the frames
+    of iter_frames) to a frame file at path and return the number of frames.
+
+    typecode is the float type of the coordinates: 'd' for float64, or 'f'
+    for float32, which halves the size of the file but rounds the points to
+    about 7 significant digits.
+
+    A piece that is in consecutive frames (the same object) is written once.
+    Only the pieces of the previous frame are remembered, so this works on a
+    stream of frames without keeping them.
+
+    The frames are written to a temporary file next to path, which replaces
+    path once it is complete, so path is never left half written.
+    """
+    if typecode not in ('d', 'f'):
+        raise ValueError('Unknown float type: ' + repr(typecode))
+    # Unlike tempfile.mkstemp, this makes the file with the permissions of
+    # the umask, like open does
+    tmp = '%s.%s.tmp' % (path, os.urandom(4).hex())
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            n = _write_frames(f, frames, typecode)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return n
+
+def _write_frames(f, frames, typecode):
+    """Write frames to the open file f (see write_frames) and return the
+    number of frames"""
+    piece_offsets = list()
+    frame_offsets = list()
+    previous = dict()
+    f.write(b'\0' * _HEADER.size)
+    offset = _HEADER.size
+    for frame in frames:
+        ids = list()
+        current = dict()
+        for piece in frame:
+            known = previous.get(id(piece)) or current.get(id(piece))
+            if known is None:
+                data = _encode_piece(piece, typecode)
+                f.write(data)
+                known = (len(piece_offsets), piece)
+                piece_offsets.append(offset)
+                offset += len(data)
+            current[id(piece)] = known
+            ids.append(known[0])
+        previous = current
+        data = _COUNT.pack(len(ids)) + _pack('I', ids)
+        f.write(data)
+        frame_offsets.append(offset)
+        offset += len(data)
+    piece_table = offset
+    f.write(_pack('Q', piece_offsets))
+    frame_table = piece_table + 8 * len(piece_offsets)
+    f.write(_pack('Q', frame_offsets))
+    f.seek(0)
+    f.write(_HEADER.pack(MAGIC, VERSION, typecode.encode(),
+                         len(frame_offsets), len(piece_offsets),
+                         piece_table, frame_table))
+    return len(frame_offsets)
+
+class FrameFile:
+    """Reads the frames of a frame file (see write_frames) like a FrameList.
+
+    The file is memory mapped, so opening it only reads the header, and the
+    pages of a frame are read by the operating system when the frame is
+    asked for. Pieces are decoded into Triangles and Shapes (of Triangles and
+    Polygons) when a frame uses them. The last max_pieces decoded pieces are
+    kept, so consecutive frames share their pieces like the frames of a
+    FrameList.
+
+    A file that is not a frame file, or is damaged, raises ValueError when
+    it is opened or when the damaged part is read.
+    """
+
+    def __init__(self, path, max_pieces=4096):
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < _HEADER.size:
+                raise ValueError('Not a frame file: ' + path)
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        try:
+            self._read_header(path)
+        except ValueError:
+            self._view.release()
+            self._mmap.close()
+            raise
+        self._max_pieces = max_pieces
+        self._pieces = OrderedDict()
+
+    def _read_header(self, path):
+        """Read the header and the offset tables, and check that they fit
+        the file"""
+        (magic, version, typecode, frames, pieces, piece_table,
+         frame_table) = _HEADER.unpack_from(self._view)
+        if magic != MAGIC:
+            raise ValueError('Not a frame file: ' + path)
+        if version != VERSION:
+            raise ValueError('Unknown frame file version: %d' % version)
+        if typecode not in (b'd', b'f'):
+            raise ValueError('Unknown float type in frame file: ' + path)
+        # The tables are the last thing written, so a file that was cut
+        # short loses them
+        if (piece_table < _HEADER.size
+                or frame_table != piece_table + 8 * pieces
+                or frame_table + 8 * frames != len(self._view)):
+            raise ValueError('Damaged frame file: ' + path)
+        self._typecode = typecode.decode()
+        self._float_size = array(self._typecode).itemsize
+        # Pieces and frames are read up to the start of the tables
+        self._end = piece_table
+        self._piece_offsets = _unpack('Q', self._view[
+            piece_table:piece_table + 8 * pieces])
+        self._frame_offsets = _unpack('Q', self._view[
+            frame_table:frame_table + 8 * frames])
+
+    def __len__(self):
+        """Return the number of frames"""
+        return len(self._frame_offsets)
+
+    @property
+    def generated(self):
+        """The number of frames that can be read without computing them,
+        which is all of them (see FrameList.generated)"""
+        return len(self)
+
+    @property
+    def piece_count(self):
+        """The number of unique pieces in the file"""
+        return len(self._piece_offsets)
+
+    def _read(self, offset, size):
+        """Return size bytes of the pieces and frames at offset. Raises
+        ValueError if they are not in the file."""
+        if not _HEADER.size <= offset <= offset + size <= self._end:
+            raise ValueError('Damaged frame file')
+        return self._view[offset:offset + size]
+
+    def frame_ids(self, i):
+        """Return the ids of the pieces of the ith frame"""
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('FrameFile index out of bounds')
+        offset = self._frame_offsets[i]
+        n, = _COUNT.unpack(self._read(offset, _COUNT.size))
+        offset += _COUNT.size
+        ids = list(_unpack('I', self._read(offset, 4 * n)))
+        if ids and max(ids) >= self.piece_count:
+            raise ValueError('Damaged frame file')
+        return ids
+
+    def __getitem__(self, i):
+        """Return the ith frame"""
+        return [self.piece(j) for j in self.frame_ids(i)]
+
+    def piece(self, j):
+        """Return the piece with id j"""
+        piece = self._pieces.get(j)
+        if piece is not None:
+            self._pieces.move_to_end(j)
+            return piece
+        offset = self._piece_offsets[j]
+        kind, n = _PIECE.unpack(self._read(offset, _PIECE.size))
+        offset += _PIECE.size
+        sizes = _unpack('I', self._read(offset, 4 * n))
+        offset += 4 * n
+        if (kind not in (_TRIANGLE, _SHAPE) or n == 0
+                or (kind == _TRIANGLE and n != 1) or min(sizes) < 3):
+            raise ValueError('Damaged frame file')
+        size = 2 * sum(sizes) * self._float_size
+        coordinates = _unpack(self._typecode,
+                              self._read(offset, size)).tolist()
+        primitives = list()
+        k = 0
+        for size in sizes:
+            points = tuple(zip(coordinates[k:k + 2 * size:2],
+                               coordinates[k + 1:k + 2 * size:2]))
+            primitives.append(Triangle(points) if size == 3
+                              else Polygon(points))
+            k += 2 * size
+        piece = Shape(primitives) if kind == _SHAPE else primitives[0]
+        self._pieces[j] = piece
+        if len(self._pieces) > self._max_pieces:
+            self._pieces.popitem(last=False)
+        return piece
+
+    def close(self):
+        """Close the file. Frames that were read stay usable."""
+        self._piece_offsets = self._frame_offsets = None
+        self._view.release()
+        self._mmap.close()
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 
 import math
-from functools import cmp_to_key, partial
+import sys
+from fractions import Fraction
+from functools import cmp_to_key
 
 PRECISION = 2**(-10)
 
@@ -27,19 +29,70 @@ def point_cmp(a, b):
     else:
         return 1
 
+# Counters for the predicates below: 'calls' is the number of times a sign
+# was asked for and 'exact' the number of those that needed exact arithmetic
+PREDICATE_STATS = {'calls': 0, 'exact': 0}
+
+# Counters for Shapes: 'split' is the number of Shape splits, 'hull' the
+# number of times a convex hull was asked for and 'hull_cached' the number of
+# those that were answered from the cache
+SHAPE_STATS = {'split': 0, 'hull': 0, 'hull_cached': 0}
+
+# A bound on the relative error of a sum of two or three rounded products
+# (see Shewchuk, Adaptive Precision Floating-Point Arithmetic and Fast Robust
+# Geometric Predicates)
+_ERROR_BOUND = 4 * sys.float_info.epsilon
+
+def _sign(value, error, tolerance, exact):
+    """Return 0 if a value is within tolerance of 0, otherwise its sign.
+
+    value is a floating point approximation which is at most error away from
+    the true value. When that is not enough to tell which side of the
+    tolerance the true value is on, exact() is called to compute the true
+    value exactly (as a Fraction).
+    """
+    PREDICATE_STATS['calls'] += 1
+    size = abs(value)
+    if size + error < tolerance:
+        return 0
+    elif size - error < tolerance:
+        PREDICATE_STATS['exact'] += 1
+        value = exact()
+        if abs(value) < tolerance:
+            return 0
+    return (value > 0) - (value < 0)
+
 def clockwise_from(p0, p1, p2):
     """Returns a value > 0 if p1 is clockwise of p2 from p0, < 0 if counter
-    clockwise and == 0 if collinear"""
+    clockwise and == 0 if collinear.
+
+    The points are collinear if the nearer of p1 and p2 to p0 is less than
+    PRECISION away from the line through p0 and the further one. This
+    tolerance grows with the points, unlike a tolerance on the cross product.
+    """
     x1, y1 = p1[0] - p0[0], p1[1] - p0[1]
     x2, y2 = p2[0] - p0[0], p2[1] - p0[1]
     ans = x1*y2 - x2*y1
-    if float_eq(ans, 0):
-        return 0
-    elif ans < 0:
-        return -1
-    else:
-        return 1
+    tolerance = PRECISION * max(math.hypot(x1, y1), math.hypot(x2, y2))
 
+    def exact():
+        (a, b), (c, d), (e, f) = [map(Fraction, p) for p in (p0, p1, p2)]
+        return (c - a) * (f - b) - (e - a) * (d - b)
+    return _sign(ans, _ERROR_BOUND * (abs(x1*y2) + abs(x2*y1)), tolerance,
+                 exact)
+
+
+def _turn(p0, p1, p2):
+    """Returns the sign of clockwise_from(p0, p1, p2) with no tolerance, so
+    that it is 0 only if the points are exactly collinear"""
+    x1, y1 = p1[0] - p0[0], p1[1] - p0[1]
+    x2, y2 = p2[0] - p0[0], p2[1] - p0[1]
+
+    def exact():
+        (a, b), (c, d), (e, f) = [map(Fraction, p) for p in (p0, p1, p2)]
+        return (c - a) * (f - b) - (e - a) * (d - b)
+    return _sign(x1*y2 - x2*y1, _ERROR_BOUND * (abs(x1*y2) + abs(x2*y1)), 0,
+                 exact)
 
 def clockwise_and_dist(p0, p1, p2):
     """Returns a value > 0 if p1 is clockwise of p2 from p0, < 0 if counter
@@ -59,6 +112,168 @@ def clockwise_and_dist(p0, p1, p2):
         return a
         
 
+# Affine transforms are stored as a 6-tuple (a, b, c, d, e, f) representing the
+# 2x3 matrix that maps (x, y) to (a*x + b*y + c, d*x + e*y + f).
+IDENTITY = (1.0, 0.0, 0.0, 0.0, 1.0, 0.0)
+
+def affine_translation(translation):
+    """Return the affine transform that translates by 'translation'"""
+    tx, ty = translation
+    return (1.0, 0.0, tx, 0.0, 1.0, ty)
+
+def affine_rotation(pivot, rangle):
+    """Return the affine transform that rotates clockwise (by rangle) around
+    pivot"""
+    px, py = pivot
+    c, s = math.cos(rangle), math.sin(rangle)
+    return (c, s, px - c*px - s*py, -s, c, py + s*px - c*py)
+
+def affine_compose(outer, inner):
+    """Return the affine transform that applies inner and then outer"""
+    a1, b1, c1, d1, e1, f1 = outer
+    a2, b2, c2, d2, e2, f2 = inner
+    return (a1*a2 + b1*d2, a1*b2 + b1*e2, a1*c2 + b1*f2 + c1,
+            d1*a2 + e1*d2, d1*b2 + e1*e2, d1*c2 + e1*f2 + f1)
+
+def affine_inverse(matrix):
+    """Return the inverse of the affine transform matrix"""
+    a, b, c, d, e, f = matrix
+    det = a*e - b*d
+    a, b, d, e = e / det, -b / det, -d / det, a / det
+    return (a, b, -a*c - b*f, d, e, -d*c - e*f)
+
+def affine_apply(matrix, point):
+    """Return point transformed by the affine transform matrix"""
+    a, b, c, d, e, f = matrix
+    x, y = point
+    return (a*x + b*y + c, d*x + e*y + f)
+
+
+def convex_hull(points):
+    """Return the convex hull of a list of points.
+
+    This uses Andrew's monotone chain algorithm [O(V log V)]. The hull is
+    returned in clockwise order (with the y-axis pointing up) starting from
+    the smallest point (see _hull_from_smallest). Collinear and repeated
+    points are left out.
+    """
+    # Exact copies (the shared corners of triangles) are dropped before
+    # sorting, and the points are sorted as plain tuples, which is well
+    # defined, unlike sorting with point_cmp
+    points = sorted(set(map(tuple, points)))
+    if len(points) < 3:
+        return [p for i, p in enumerate(points)
+                if i == 0 or not point_eq(p, points[i - 1])]
+    upper = _chain(points)
+    lower = _chain(reversed(points))
+    # Points that are all equal within PRECISION leave a single point
+    hull = upper[:-1] + lower[:-1] or upper[:1]
+    # The chains only leave out points that are exactly collinear, so points
+    # that are collinear within PRECISION (or equal within PRECISION, where
+    # the two chains join) are left out here. Of nearly collinear points
+    # only the one in the middle goes, so that the ends of a hull that is
+    # thinner than PRECISION are kept
+    i = 0
+    while len(hull) > 2 and i < len(hull):
+        p, q, r = hull[i - 1], hull[i], hull[(i + 1) % len(hull)]
+        if point_eq(p, q) or (clockwise_from(p, q, r) >= 0 and
+                              (p[0] - q[0]) * (r[0] - q[0])
+                              + (p[1] - q[1]) * (r[1] - q[1]) <= 0):
+            del hull[i]
+            i = max(i - 1, 0)
+        else:
+            i += 1
+    return _hull_from_smallest(hull)
+
+def _chain(points):
+    """Return one chain of the monotone chain algorithm (see convex_hull),
+    leaving out points that are equal within PRECISION to the last point of
+    the chain.
+
+    The turns are decided exactly, without a tolerance: the points are
+    sorted by x and then y, and a tolerance would let a point that only
+    looks collinear, at the end of a nearly vertical run, be dropped.
+    """
+    chain = list()
+    for p in points:
+        while len(chain) >= 2 and _turn(chain[-2], chain[-1], p) >= 0:
+            chain.pop()
+        if not chain or not point_eq(chain[-1], p):
+            chain.append(p)
+    return chain
+
+def _hull_from_smallest(hull):
+    """Rotate the list hull so that it starts at its smallest point: of the
+    points with an x coordinate within PRECISION of the smallest one, the one
+    with the smallest y coordinate (the way point_cmp orders them)"""
+    if len(hull) == 0:
+        return hull
+    left = min(p[0] for p in hull)
+    i = min((i for i, p in enumerate(hull) if float_eq(p[0], left)),
+            key=lambda i: (hull[i][1], hull[i][0]))
+    return hull[i:] + hull[:i]
+
+def transform_hull(hull, matrix):
+    """Return the convex hull (see convex_hull) of the points that hull
+    was computed from, after they have been transformed by the affine
+    transform matrix"""
+    hull = [affine_apply(matrix, p) for p in hull]
+    a, b, c, d, e, f = matrix
+    if a*e - b*d < 0:
+        # Reflections turn the hull around
+        hull.reverse()
+    return _hull_from_smallest(hull)
+
+
+class VertexTable:
+    """A table of unique points.
+
+    Points that are equal within PRECISION (see point_eq) are snapped to the
+    first of them that was added. The points are kept in a hash grid with
+    cells PRECISION wide, so finding the point that another one snaps to only
+    looks at the 9 cells around it [O(1)].
+    """
+
+    def __init__(self, points=()):
+        """points is an iterable of points to add to the table"""
+        self.points = list()
+        self._grid = dict()
+        # Most repeated points are exact copies, which are found without
+        # searching the grid
+        self._exact = dict()
+        for p in points:
+            self.add(p)
+
+    def __len__(self):
+        return len(self.points)
+
+    def _cell(self, point):
+        return (math.floor(point[0] / PRECISION),
+                math.floor(point[1] / PRECISION))
+
+    def find(self, point):
+        """Return the index of the point that point snaps to, or None"""
+        cx, cy = self._cell(point)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for i in self._grid.get((cx + dx, cy + dy), ()):
+                    if point_eq(point, self.points[i]):
+                        return i
+        return None
+
+    def add(self, point):
+        """Add point to the table (unless it snaps to a point already in it)
+        and return its index"""
+        i = self._exact.get(point)
+        if i is None:
+            i = self.find(point)
+            if i is None:
+                i = len(self.points)
+                self.points.append(point)
+                self._grid.setdefault(self._cell(point), []).append(i)
+            self._exact[point] = i
+        return i
+
 
 def line_intersects_segment(line, line_segment):
     """Returns the intersection the Line and LineSegment or None if they do
@@ -125,7 +340,10 @@ class LineSegment:
         A = y1 - y2
         B = x2 - x1
         C = -A*x1 - B*y1
-        assert float_eq(C, -A*x2 - B*y2)
+        # Both ends give the same C, up to rounding errors that grow with the
+        # coordinates
+        assert abs(C + A*x2 + B*y2) <= 2 * _ERROR_BOUND * (
+            abs(A*x1) + abs(B*y1) + abs(A*x2) + abs(B*y2))
         line = Line(A, B, C)
         return line
     
@@ -165,26 +383,36 @@ class Line:
 
     def side_of_line(self, point):
         """Returns the number 1, 0, -1 if point is on the positive side, on the
-        line, on the negative side of the line respectively."""
+        line, on the negative side of the line respectively.
 
+        The point is on the line if it is less than PRECISION away from it.
+        """
         A, B, C = self.A, self.B, self.C
         x, y = point
         value = A * x + B * y + C
-        if float_eq(value, 0):
-            return 0
-        elif value > 0:
-            return 1
-        elif value < 0:
-            return -1
+        tolerance = PRECISION * math.hypot(A, B)
+
+        def exact():
+            return (Fraction(A) * Fraction(x) + Fraction(B) * Fraction(y)
+                    + Fraction(C))
+        return _sign(value, _ERROR_BOUND * (abs(A * x) + abs(B * y) + abs(C)),
+                     tolerance, exact)
 
     def is_parallel_to(self, line2):
-        """Checks if this lines is parallel to line2. """
-        A1, B1, C1 = self.A, self.B, self.C
-        A2, B2, C2 = line2.A, line2.B, line2.C
-        if float_eq(A1 * B2, A2 * B1):
-            return True
-        else:
-            return False
+        """Checks if this lines is parallel to line2.
+
+        The lines are parallel if the sine of the angle between them is less
+        than PRECISION**2.
+        """
+        A1, B1 = self.A, self.B
+        A2, B2 = line2.A, line2.B
+        det = A1 * B2 - A2 * B1
+        tolerance = PRECISION**2 * math.hypot(A1, B1) * math.hypot(A2, B2)
+
+        def exact():
+            return Fraction(A1) * Fraction(B2) - Fraction(A2) * Fraction(B1)
+        return _sign(det, _ERROR_BOUND * (abs(A1 * B2) + abs(A2 * B1)),
+                     tolerance, exact) == 0
 
     def intersection(self, line2):
         """Calculate the intersection of this line with line2"""
@@ -228,9 +456,13 @@ class Triangle:
     data structure. All methods return a new triangle and do not modify the
     existing one."""
 
-    def __init__(self, tpl):
-        """tpl is a 3-tuple of coordinates"""
+    def __init__(self, tpl, origin=None):
+        """tpl is a 3-tuple of coordinates. origin is the affine transform
+        that moved the part of the polygon this triangle was cut from to
+        where the triangle is, or None if it is not tracked. The triangles
+        cut from this one and this triangle moved keep track of it."""
         self.points = tpl
+        self.origin = origin
 
     def __iter__(self):
         """Returns the tuple of points"""
@@ -285,23 +517,22 @@ class Triangle:
         
         pivot -- A coordinate pair
         rangle -- The angle to rotate by in radians"""
-        new_points = list()
-        px, py = pivot
-        for x, y in self.points:
-            dx, dy = x - px, y - py
-            current_angle = math.atan2(dy, dx)
-            total_angle = current_angle - rangle
-            r = math.hypot(dx, dy)
-            nx = r*math.cos(total_angle) + px
-            ny = r*math.sin(total_angle) + py
-            new_points.append((nx, ny))
-        return Triangle(tuple(new_points))
+        return self.transform(affine_rotation(pivot, rangle))
+
+    def transform(self, matrix):
+        """Return a new triangle transformed by the affine transform matrix"""
+        return Triangle(tuple(affine_apply(matrix, p) for p in self.points),
+                        _moved_origin(self.origin, matrix))
 
     def translate(self, translation):
         """Return a new triangle translated by 'translation'"""
         tx, ty = translation
         new_points = [(x + tx, y + ty) for x, y in self.points]
-        return Triangle(tuple(new_points))
+        if self.origin is None:
+            # The usual case, which should not pay for origins
+            return Triangle(tuple(new_points))
+        return Triangle(tuple(new_points), _moved_origin(
+            self.origin, affine_translation(translation)))
 
     def to_rightangle(self):
         """Splits the triangle into two right-angled triangles"""
@@ -312,8 +543,8 @@ class Triangle:
         other_points = [(big_point + 1) % 3, (big_point + 2) % 3]
         cut = self.segments[big_point].to_line().perpendicular(p[big_point])
         new_point = line_intersects_segment(cut, self.segments[big_point])
-        t1 =  Triangle((p[big_point], new_point, p[other_points[0]]))
-        t2 =  Triangle((p[big_point], new_point, p[other_points[1]]))
+        t1 =  Triangle((p[big_point], new_point, p[other_points[0]]), self.origin)
+        t2 =  Triangle((p[big_point], new_point, p[other_points[1]]), self.origin)
         return (t1, t2)
         
     def split(self, line):
@@ -339,8 +570,8 @@ class Triangle:
                 inverse[s % 3] = self.points[i]
             base = LineSegment(inverse[1], inverse[2])
             basepoint = line_intersects_segment(line, base)
-            pos_shape = Triangle((basepoint, inverse[0], inverse[1]))
-            neg_shape = Triangle((basepoint, inverse[0], inverse[2]))
+            pos_shape = Triangle((basepoint, inverse[0], inverse[1]), self.origin)
+            neg_shape = Triangle((basepoint, inverse[0], inverse[2]), self.origin)
             return (Shape([pos_shape]), Shape([neg_shape]))
 
         # Line is "tangent" to triangle
@@ -363,18 +594,185 @@ class Triangle:
                 elif s == -1:
                     sided_points[0].append(self.points[i])
             if len(sided_points[0]) == 1:
-                t1 = Triangle((sided_points[0][0], intersects[0], intersects[1]))
-                t2 = Triangle((sided_points[1][0], intersects[0], intersects[1]))
-                t3 = Triangle((sided_points[1][0], sided_points[1][1], intersects[0]))
+                t1 = Triangle((sided_points[0][0], intersects[0], intersects[1]), self.origin)
+                t2 = Triangle((sided_points[1][0], intersects[0], intersects[1]), self.origin)
+                t3 = Triangle((sided_points[1][0], sided_points[1][1], intersects[0]), self.origin)
                 return (Shape([t2, t3]), Shape([t1]))
             elif len(sided_points[1]) == 1:
-                t1 = Triangle((sided_points[1][0], intersects[0], intersects[1]))
-                t2 = Triangle((sided_points[0][0], intersects[0], intersects[1]))
-                t3 = Triangle((sided_points[0][0], sided_points[0][1], intersects[0]))
+                t1 = Triangle((sided_points[1][0], intersects[0], intersects[1]), self.origin)
+                t2 = Triangle((sided_points[0][0], intersects[0], intersects[1]), self.origin)
+                t3 = Triangle((sided_points[0][0], sided_points[0][1], intersects[0]), self.origin)
                 return (Shape([t1]), Shape([t2, t3]))
             else:
                 raise Exception("Segments missing")
 
+def _moved_origin(origin, matrix):
+    """Return the origin (see Triangle) of a primitive moved by matrix"""
+    return None if origin is None else affine_compose(matrix, origin)
+
+def clip_polygon(polygon, line, side):
+    """Return the part of the convex polygon (a list of points) on the given
+    side (1 or -1) of line. Points on the line are kept."""
+    values = [line.A * x + line.B * y + line.C for x, y in polygon]
+    sides = [line.side_of_line(p) * side for p in polygon]
+    clipped = list()
+    for i, p in enumerate(polygon):
+        j = i - 1
+        if sides[i] * sides[j] < 0:
+            # The edge from the previous point crosses the line
+            t = values[j] / (values[j] - values[i])
+            (x0, y0), (x1, y1) = polygon[j], p
+            clipped.append((x0 + t * (x1 - x0), y0 + t * (y1 - y0)))
+        if sides[i] >= 0:
+            clipped.append(p)
+    return clipped
+
+class Polygon:
+    """A convex polygon.
+
+    Polygons are made by consolidate, which joins triangles of a shape back
+    together. They can be used in a Shape in place of triangles: like
+    Triangle, the polygon is represented as a tuple of points and can be
+    rotated, translated and split.
+
+    The Polygon should be treated as an immutable data structure."""
+
+    def __init__(self, tpl, origin=None):
+        """tpl is a tuple of coordinates in counter clockwise order. origin
+        is tracked like Triangle's."""
+        self.points = tpl
+        self.origin = origin
+
+    def __iter__(self):
+        """Returns the tuple of points"""
+        return iter(self.points)
+
+    def area(self):
+        """Return area of polygon"""
+        p = self.points
+        return abs(0.5 * sum(p[i - 1][0] * p[i][1] - p[i][0] * p[i - 1][1]
+                             for i in range(len(p))))
+
+    def rotate(self, pivot, rangle):
+        """Return a new polygon rotate clockwise (by angle) around pivot."""
+        return self.transform(affine_rotation(pivot, rangle))
+
+    def transform(self, matrix):
+        """Return a new polygon transformed by the affine transform matrix"""
+        return Polygon(tuple(affine_apply(matrix, p) for p in self.points),
+                       _moved_origin(self.origin, matrix))
+
+    def translate(self, translation):
+        """Return a new polygon translated by 'translation'"""
+        return self.transform(affine_translation(translation))
+
+    def split(self, line):
+        """Splits the Polygon into two shapes separated by line.
+
+        All the points of the first shape will be on the non-negative side of
+        line. All the points of the second shape will be on the non-positive
+        side of the line. Like Triangle.split, a polygon that only touches
+        the line stays whole.
+        """
+        sides = [line.side_of_line(p) for p in self.points]
+        if 1 not in sides:
+            return (Shape([]), Shape([self]))
+        elif -1 not in sides:
+            return (Shape([self]), Shape([]))
+        pieces = list()
+        for side in (1, -1):
+            points = clip_polygon(self.points, line, side)
+            points = [q for i, q in enumerate(points)
+                      if not point_eq(q, points[i - 1])]
+            pieces.append(Shape([Polygon(tuple(points), self.origin)]
+                                if len(points) >= 3 else []))
+        return tuple(pieces)
+
+def consolidate(primitives):
+    """Join triangles (or polygons) that share an edge into convex polygons.
+
+    primitives is a list of Triangles and Polygons that move together (the
+    triangles of a Shape). Pairs of primitives that share a whole edge are
+    joined greedily for as long as the result is convex, and points left in
+    the middle of a straight side are dropped. Primitives that are not joined
+    to anything are returned as they are, the others as Polygons. The order
+    of the primitives is kept. Primitives with different origins (see
+    Triangle) are not joined.
+    """
+    table = VertexTable()
+    cycles = list()
+    for primitive in primitives:
+        cycle = [table.add(p) for p in primitive.points]
+        cycle = [v for i, v in enumerate(cycle) if v != cycle[i - 1]]
+        if len(cycle) >= 3:
+            points = [table.points[v] for v in cycle]
+            if Polygon(tuple(points)).area() < PRECISION**2:
+                cycle = None
+            elif sum(points[i - 1][0] * points[i][1] - points[i][0] * points[i - 1][1]
+                     for i in range(len(points))) < 0:
+                cycle.reverse()
+        else:
+            cycle = None
+        cycles.append(cycle)
+    # True for the primitives that others were joined to and None for the
+    # ones that were joined to another
+    joined = [False] * len(cycles)
+    owner = dict()
+    for n, cycle in enumerate(cycles):
+        if cycle is not None:
+            for k in range(len(cycle)):
+                owner[(cycle[k - 1], cycle[k])] = n
+
+    def convex_at(cycle, k):
+        a, b, c = (table.points[cycle[k - 1]], table.points[cycle[k]],
+                   table.points[cycle[(k + 1) % len(cycle)]])
+        return clockwise_from(a, b, c)
+
+    for n in range(len(cycles)):
+        k = 0
+        while cycles[n] is not None and k < len(cycles[n]):
+            cycle = cycles[n]
+            i, j = cycle[k - 1], cycle[k]
+            m = owner.get((j, i))
+            if (m is None or m == n or cycles[m] is None
+                    or primitives[m].origin != primitives[n].origin):
+                k += 1
+                continue
+            other = cycles[m]
+            # Walk this cycle from j round to i and the other from i round to
+            # j, leaving out the shared edge
+            a = cycle[k:] + cycle[:k]
+            b = other.index(i)
+            b = other[b:] + other[:b]
+            union = a + b[1:-1]
+            ends = (0, len(a) - 1)
+            turns = [convex_at(union, e) for e in ends]
+            if min(turns) < 0:
+                k += 1
+                continue
+            for e in reversed(ends):
+                if turns[ends.index(e)] == 0:
+                    del union[e]
+            for c in (cycle, other):
+                for e in range(len(c)):
+                    owner.pop((c[e - 1], c[e]), None)
+            for e in range(len(union)):
+                owner[(union[e - 1], union[e])] = n
+            cycles[n] = union
+            cycles[m] = None
+            joined[n] = True
+            joined[m] = None
+            k = 0
+
+    result = list()
+    for n, primitive in enumerate(primitives):
+        if joined[n]:
+            result.append(Polygon(tuple(table.points[v] for v in cycles[n]),
+                                  primitive.origin))
+        elif joined[n] is not None:
+            result.append(primitive)
+    return result
+
 class Shape:
     """A class structure for representing and minipulating arbitary shapes.
     
@@ -382,14 +780,35 @@ class Shape:
     operations can be applied to a shape such as rotation, translation and
     splitting the shape into two.
 
+    Rotations and translations are not applied straight away. Instead the
+    shape keeps a pending affine transform that the next rotation or
+    translation is composed with, and the triangles are only transformed when
+    something (a split, the convex hull or drawing) asks for them. The
+    transformed triangles are kept next to the untransformed ones, so that
+    asking for them does not change how later transforms are rounded.
+
     This object should be treated as an immutable data structure. All methods
     return new shapes and do not modify the existing one."""
 
-    def __init__(self, triangle_list):
-        """triangle_list is a list of triangles"""
-        self.triangles = triangle_list
+    def __init__(self, triangle_list, transform=None):
+        """triangle_list is a list of triangles, transform is an affine
+        transform still to be applied to them (None for no transform)"""
+        self._triangles = triangle_list
+        self._transform = transform
+        self._transformed = None
         self._convex_hull = None
 
+    @property
+    def triangles(self):
+        """The list of triangles in the shape, with any pending transform
+        applied"""
+        if self._transform is None:
+            return self._triangles
+        if self._transformed is None:
+            m = self._transform
+            self._transformed = [t.transform(m) for t in self._triangles]
+        return self._transformed
+
     def split(self, line):
         """Splits the Shape into two shapes separated by line.
 
@@ -397,6 +816,7 @@ class Shape:
         line. All the points of the second shape will be on the non-positive
         side of the line.
         """
+        SHAPE_STATS['split'] += 1
         up = list()
         down = list()
         for t in self.triangles:
@@ -405,56 +825,80 @@ class Shape:
             down.extend(d.triangles)
         return (Shape(up), Shape(down))
 
+    def __len__(self):
+        """Return the number of triangles in the shape"""
+        return len(self._triangles)
+
+    def __add__(self, other):
+        """Return a new Shape containing the triangles of both shapes"""
+        shape = Shape(self.triangles + other.triangles)
+        if self._convex_hull is not None and other._convex_hull is not None:
+            shape._convex_hull = convex_hull(self._convex_hull
+                                             + other._convex_hull)
+        return shape
+
+    def transform(self, matrix):
+        """Return a new Shape transformed by the affine transform matrix.
+
+        This runs in O(1), the transform is composed with the pending one.
+        """
+        shape = Shape(self._triangles, matrix if self._transform is None
+                      else affine_compose(matrix, self._transform))
+        if self._convex_hull is not None:
+            shape._convex_hull = transform_hull(self._convex_hull, matrix)
+        return shape
+
     def translate(self, translation):
         """Return a new Shape translated by 'translation'"""
-        return Shape([t.translate(translation) for t in self.triangles])
+        return self.transform(affine_translation(translation))
 
     def rotate(self, pivot, rangle):
         """Return a new Shape rotate clockwise (by angle) around pivot."""
-        return Shape([t.rotate(pivot, rangle) for t in self.triangles])
-    
+        return self.transform(affine_rotation(pivot, rangle))
+
+    def area(self):
+        """Return the area of the shape"""
+        area = sum(t.area() for t in self._triangles)
+        if self._transform is not None:
+            a, b, c, d, e, f = self._transform
+            area *= abs(a*e - b*d)
+        return area
+
+    def bounding_box(self):
+        """Return the axis aligned bounding box of the shape as a pair of
+        points (min_x, min_y), (max_x, max_y)"""
+        xs = [x for t in self.triangles for x, y in t.points]
+        ys = [y for t in self.triangles for x, y in t.points]
+        return ((min(xs), min(ys)), (max(xs), max(ys)))
+
     def vertices(self):
-        """Return unique vertices inside this shape.
-        
-        NOTE: this method runs in O(V log V)
+        """Return unique vertices inside this shape, sorted by point_cmp.
+
+        The points are deduplicated with a VertexTable [O(V)], so only the
+        unique vertices are sorted.
         """
-        vertices = list()
-        for t in self.triangles:
-            vertices.extend(t.points)
-        vertices.sort(key=cmp_to_key(point_cmp))
-        undup = list()
-        for v in vertices:
-            if len(undup) == 0 or not point_eq(v, undup[-1]):
-                undup.append(v)
-        return undup
+        table = VertexTable(p for t in self.triangles for p in t.points)
+        return sorted(table.points, key=cmp_to_key(point_cmp))
     
+    def consolidate(self):
+        """Return the shape with its triangles joined into convex polygons
+        where they share an edge (see consolidate)"""
+        shape = Shape(consolidate(self._triangles), self._transform)
+        shape._convex_hull = self._convex_hull
+        return shape
+
     def convex_hull(self):
-        """Return the convex hull of the shape.
-        
-        This uses grahams algorithm [O(V log V)] and caches the result inside
-        self._convex_hull .
+        """Return the convex hull of the shape (see convex_hull).
+
+        The result is cached inside self._convex_hull, and carried over to
+        shapes made from this one by transform, rotate and translate.
         """
-        verts = self.vertices()
-        if len(verts) == 0:
-            self._convex_hull = []
-        elif self._convex_hull is None:
-            p = min(verts, key=cmp_to_key(point_cmp))
-            verts.remove(p)
-            ps = sorted(verts, key=cmp_to_key(partial(clockwise_and_dist, p)))
-            ps.append(p)
-            hull = [p, ps[0]]
-            i = 1
-            while clockwise_from(hull[0], hull[1], ps[i]) >= 0:
-                hull.pop()
-                hull.append(ps[i])
-                i += 1
-            hull.append(ps[i])
-            for l in ps[i:]:
-                while clockwise_from(hull[-2], hull[-1], l) >= 0:
-                    hull.pop()
-                hull.append(l)
-            hull.pop()
-            self._convex_hull = hull
+        SHAPE_STATS['hull'] += 1
+        if self._convex_hull is None:
+            self._convex_hull = convex_hull([p for t in self.triangles
+                                             for p in t.points])
+        else:
+            SHAPE_STATS['hull_cached'] += 1
         return self._convex_hull
 
     def height(self):
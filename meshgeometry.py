@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""An indexed mesh Shape.
+
+A MeshShape keeps one table of unique vertices and describes every triangle
+as a triple of indices into it, so triangles that touch share their corners
+instead of each having a copy.
+"""
+
+from functools import cmp_to_key
+
+from geometry import (SHAPE_STATS, Shape, Triangle, VertexTable, affine_apply,
+                      affine_compose, convex_hull, point_cmp, transform_hull)
+
+def _compact(points, faces):
+    """Return the points used by faces and the faces renumbered to index
+    into them"""
+    index = dict()
+    used = list()
+    new_faces = list()
+    for face in faces:
+        new_face = list()
+        for i in face:
+            if i not in index:
+                index[i] = len(used)
+                used.append(points[i])
+            new_face.append(index[i])
+        new_faces.append(tuple(new_face))
+    return used, new_faces
+
+class MeshShape(Shape):
+    """A Shape stored as a vertex table and triples of indices into it.
+
+    Corners that are equal within PRECISION are snapped together (see
+    VertexTable) when the shape is built, so the unique vertices, the edges
+    and the neighbours of every triangle can be found in O(V). Splitting the
+    shape cuts every edge once, however many triangles share it, so the
+    triangles on either side of a cut edge still share the new point.
+
+    Like Shape, rotations and translations are composed into a pending
+    transform, which is applied to the vertex table (not to every corner of
+    every triangle) when the coordinates are needed.
+
+    Like Shape, this object should be treated as an immutable data structure.
+    """
+
+    def __init__(self, triangle_list, transform=None):
+        """triangle_list is a list of triangles, transform is an affine
+        transform still to be applied to them"""
+        table = VertexTable()
+        faces = [tuple(table.add(p) for p in t.points) for t in triangle_list]
+        self._init_mesh(table.points, faces, transform)
+
+    def _init_mesh(self, points, faces, transform):
+        self._points = points
+        self._faces = faces
+        self._transform = transform
+        self._transformed = None
+        self._triangles = None
+        self._convex_hull = None
+
+    @classmethod
+    def from_mesh(cls, points, faces, transform=None):
+        """Return a MeshShape of the faces (index triples) into the list of
+        unique points"""
+        shape = cls.__new__(cls)
+        shape._init_mesh(points, faces, transform)
+        return shape
+
+    @property
+    def points(self):
+        """The vertex table with any pending transform applied"""
+        if self._transform is None:
+            return self._points
+        if self._transformed is None:
+            m = self._transform
+            self._transformed = [affine_apply(m, p) for p in self._points]
+        return self._transformed
+
+    @property
+    def faces(self):
+        """The triangles as triples of indices into points"""
+        return self._faces
+
+    @property
+    def triangles(self):
+        """A list of Triangles, built from the mesh when first needed"""
+        if self._triangles is None:
+            points = self.points
+            self._triangles = [Triangle(tuple(points[i] for i in f))
+                               for f in self._faces]
+        return self._triangles
+
+    def edges(self):
+        """Return a dictionary from every edge (a pair of point indices,
+        smallest first) to the indices of the faces it belongs to"""
+        edges = dict()
+        for n, face in enumerate(self._faces):
+            for k in range(3):
+                i, j = face[k], face[(k + 1) % 3]
+                edges.setdefault((min(i, j), max(i, j)), []).append(n)
+        return edges
+
+    def adjacency(self):
+        """Return a list with the indices of the neighbouring faces (the
+        faces sharing an edge) of every face"""
+        neighbours = [list() for f in self._faces]
+        for faces in self.edges().values():
+            for n in faces:
+                neighbours[n].extend(m for m in faces if m != n)
+        return neighbours
+
+    def split(self, line):
+        """Splits the Shape into two shapes separated by line.
+
+        All the points of the first shape will be on the non-negative side of
+        line. All the points of the second shape will be on the non-positive
+        side of the line. The triangles are cut the same way as
+        Triangle.split, but every point is only classified once and every
+        edge is only cut once.
+        """
+        SHAPE_STATS['split'] += 1
+        points = list(self.points)
+        A, B, C = line.A, line.B, line.C
+        values = [A * x + B * y + C for x, y in points]
+        sides = [line.side_of_line(p) for p in points]
+        cuts = dict()
+
+        def cut(i, j):
+            """Return the index of the point where line crosses edge i, j"""
+            edge = (min(i, j), max(i, j))
+            if edge not in cuts:
+                a, b = edge
+                t = values[a] / (values[a] - values[b])
+                (xa, ya), (xb, yb) = points[a], points[b]
+                cuts[edge] = len(points)
+                points.append((xa + t * (xb - xa), ya + t * (yb - ya)))
+            return cuts[edge]
+
+        up = list()
+        down = list()
+        for face in self._faces:
+            s = [sides[i] for i in face]
+            # The whole triangle is on the same side of the line
+            if s[0] == s[1] == s[2]:
+                (up if s[0] == 1 else down).append(face)
+            # The triangle is cut into two, on one vertex
+            elif sorted(s) == [-1, 0, 1]:
+                zero, pos, neg = (face[s.index(k)] for k in (0, 1, -1))
+                basepoint = cut(pos, neg)
+                up.append((basepoint, zero, pos))
+                down.append((basepoint, zero, neg))
+            # Line is "tangent" to triangle
+            elif 0 in s:
+                (up if 1 in s else down).append(face)
+            # Line intersects two edges
+            else:
+                p0, p1, p2 = face
+                intersects = [cut(i, j) for i, j in ((p1, p2), (p0, p2), (p0, p1))
+                              if sides[i] != sides[j]]
+                negative = [i for i in face if sides[i] == -1]
+                positive = [i for i in face if sides[i] == 1]
+                if len(negative) == 1:
+                    lone, pair, lone_side, pair_side = negative[0], positive, down, up
+                else:
+                    lone, pair, lone_side, pair_side = positive[0], negative, up, down
+                x0, x1 = intersects
+                lone_side.append((lone, x0, x1))
+                pair_side.append((pair[0], x0, x1))
+                pair_side.append((pair[0], pair[1], x0))
+        return (MeshShape.from_mesh(*_compact(points, up)),
+                MeshShape.from_mesh(*_compact(points, down)))
+
+    def __len__(self):
+        """Return the number of triangles in the shape"""
+        return len(self._faces)
+
+    def __add__(self, other):
+        """Return a new MeshShape containing the triangles of both shapes.
+
+        The vertices of other are snapped to the vertices of this shape, so
+        the two shapes share the points along the edges where they touch.
+        """
+        if not isinstance(other, MeshShape):
+            other = MeshShape(other.triangles)
+        table = VertexTable()
+        faces = list()
+        for shape in (self, other):
+            index = [table.add(p) for p in shape.points]
+            faces.extend(tuple(index[i] for i in f) for f in shape.faces)
+        shape = MeshShape.from_mesh(table.points, faces)
+        if self._convex_hull is not None and other._convex_hull is not None:
+            shape._convex_hull = convex_hull(self._convex_hull
+                                             + other._convex_hull)
+        return shape
+
+    def transform(self, matrix):
+        """Return a new MeshShape transformed by the affine transform matrix.
+
+        This runs in O(1), the transform is composed with the pending one.
+        """
+        shape = MeshShape.from_mesh(self._points, self._faces,
+                                    matrix if self._transform is None
+                                    else affine_compose(matrix, self._transform))
+        if self._convex_hull is not None:
+            shape._convex_hull = transform_hull(self._convex_hull, matrix)
+        return shape
+
+    def area(self):
+        """Return the area of the shape"""
+        points = self._points
+        area = 0
+        for i, j, k in self._faces:
+            (x0, y0), (x1, y1), (x2, y2) = points[i], points[j], points[k]
+            area += abs((x1 - x0) * (y2 - y0) - (x2 - x0) * (y1 - y0))
+        area *= 0.5
+        if self._transform is not None:
+            a, b, c, d, e, f = self._transform
+            area *= abs(a*e - b*d)
+        return area
+
+    def bounding_box(self):
+        """Return the axis aligned bounding box of the shape as a pair of
+        points (min_x, min_y), (max_x, max_y)"""
+        xs = [x for x, y in self.points]
+        ys = [y for x, y in self.points]
+        return ((min(xs), min(ys)), (max(xs), max(ys)))
+
+    def vertices(self):
+        """Return unique vertices inside this shape, sorted by point_cmp.
+
+        The vertex table is already unique, so this only sorts it.
+        """
+        return sorted(self.points, key=cmp_to_key(point_cmp))
+
+    def convex_hull(self):
+        """Return the convex hull of the shape (see geometry.convex_hull).
+
+        The result is cached like Shape.convex_hull, and is computed from the
+        vertex table rather than from every corner of every triangle.
+        """
+        SHAPE_STATS['hull'] += 1
+        if self._convex_hull is None:
+            self._convex_hull = convex_hull(self.points)
+        else:
+            SHAPE_STATS['hull_cached'] += 1
+        return self._convex_hull
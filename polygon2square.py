@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 
 from tkinter import *
-from tkinter import ttk
+from tkinter import filedialog, ttk
 from random import randint
 from collections import defaultdict
+import threading
+import framefile
 import polygongeometry as pg
 
 PHI = (1 + 5**0.5) / 2
@@ -13,8 +15,17 @@ canvas_height = 500
 points = list()
 last_line = None
 
-# A frame list for converting this polygon into a square
+# The polygon that is being squared (None if the frames were loaded from a
+# file), a frame list for converting it into a square, and the
+# FramePrefetcher that generates its frames in the background
+polygon = None
 frames = None
+prefetcher = None
+
+# The position of the frame that should be drawn once it has been generated,
+# and whether show_progress is polling for it
+wanted = None
+polling = False
 
 def add_point(event):
     """Adds a point to the 'points' list and draw it on the canvas"""
@@ -58,34 +69,64 @@ def triangle_color(tri):
     color = _triangle_color[int(tri.area()/pg.PRECISION)]
     return '#' + hex(color)[2:].rjust(6, '0')
 
-def draw_triangle(tri):
-    """Take a triangle and draws it on the canvas"""
-    i = canvas.create_polygon(tri.points, fill=triangle_color(tri))
-    canvas.addtag('triangle', 'withtag', i)
-    a = tri.points
-    b = tri.points[1:] + (tri.points[0],)
-    for p, q in zip(a, b):
-        i = canvas.create_line((p[0], p[1], q[0], q[1]))
-        canvas.addtag('line', 'withtag', i)
+# Maps the points of every triangle on the canvas to the ids of the canvas
+# items that show it
+drawn = dict()
 
-def draw_shapes(shapes):
-    """Take a list of Shapes or Triangles and draws it on the canvas."""
+def frame_triangles(shapes):
+    """Generate the triangles in a list of Shapes or Triangles"""
     for s in shapes:
         if isinstance(s, pg.Triangle):
-            draw_triangle(s)
+            yield s
         elif isinstance(s, pg.Shape):
-            for t in s.triangles:
-                draw_triangle(t)
+            yield from s.triangles
         else:
             raise Exception("List may only contain shapes and triangles")
 
+def draw_shapes(shapes):
+    """Take a list of Shapes or Triangles and draws it on the canvas.
+
+    Only the triangles that are not on the canvas already are drawn. They
+    reuse the items of the triangles that are no longer in the list (by
+    moving them with canvas.coords), and the items that are left over are
+    deleted.
+    """
+    global drawn
+    now_drawn = defaultdict(list)
+    new = list()
+    for t in frame_triangles(shapes):
+        items = drawn.get(t.points)
+        if items:
+            now_drawn[t.points].append(items.pop())
+        else:
+            new.append(t)
+    spare = [i for items in drawn.values() for i in items]
+    for t in new:
+        if spare:
+            i = spare.pop()
+            canvas.coords(i, *[c for p in t.points for c in p])
+            canvas.itemconfigure(i, fill=triangle_color(t))
+        else:
+            i = canvas.create_polygon(t.points, fill=triangle_color(t),
+                                      outline='black', tags='triangle')
+        now_drawn[t.points].append(i)
+    for i in spare:
+        canvas.delete(i)
+    drawn = now_drawn
+
 def clear_canvas():
     """Deletes the current polygon from the canvas."""
-    global points
+    global points, prefetcher
+    if prefetcher is not None:
+        prefetcher.close()
+        prefetcher = None
+        progress.stop()
+        status.set('')
     # Delete all points
     points = list()
     # Clear lines, points and triangles from the canvas
     canvas.delete('line', 'point', 'triangle')
+    drawn.clear()
 
 def enable_controls():
     for c in controlsframe.winfo_children():
@@ -93,30 +134,108 @@ def enable_controls():
 
 def squarify_polygon(*args):
     """Takes the polygon, triangulates it and enables the controls"""
-    global frames
-    frames = pg.FrameList(points)
+    global polygon, frames, prefetcher
+    polygon = list(points)
+    frames = pg.FrameList(polygon)
+    clear_canvas()
+    prefetcher = pg.FramePrefetcher(frames)
     enable_controls()
     jump_to_position(0)
 
-def jump_to_position(pos):
-    """Jump to the position (-1 for final position)"""
-    # If the position is less than zero, we need to genrate all positions
-    if pos < 0:
-        a = 0
+def load_frames():
+    """Shows the frames of a frame file (see framefile) instead of squaring a
+    polygon"""
+    global polygon, frames, prefetcher
+    path = filedialog.askopenfilename(
+        filetypes=[('Frame files', '*.sqf'), ('All files', '*')])
+    if not path:
+        return
+    try:
+        loaded = framefile.FrameFile(path)
+    except (OSError, ValueError) as e:
+        status.set('Error: %s' % str(e)[:40])
+        return
+    clear_canvas()
+    polygon, frames = None, loaded
+    prefetcher = pg.FramePrefetcher(frames)
+    enable_controls()
+    jump_to_position(0)
+
+def save_frames():
+    """Saves the frames of the polygon to a frame file (see framefile).
+
+    The frames are generated again in a background thread, so the frames
+    being shown are not touched.
+    """
+    if polygon is None:
+        return
+    path = filedialog.asksaveasfilename(
+        defaultextension='.sqf', filetypes=[('Frame files', '*.sqf')])
+    if not path:
+        return
+    result = list()
+    def write():
         try:
-            # Generate and find the last frame
-            while True:
-                f = frames[a]
-                a += 1
-        except IndexError:
-            pos = a + pos
+            n = framefile.write_frames(
+                path, (f for i, f in pg.iter_frames(polygon)))
+            result.append('Saved %d frames' % n)
+        except Exception as e:
+            result.append('Error: %s' % str(e)[:40])
+    def check():
+        if result:
+            status.set(result[0])
+        else:
+            root.after(100, check)
+    threading.Thread(target=write, daemon=True).start()
+    status.set('Saving...')
+    check()
+
+def jump_to_position(pos):
+    """Jump to the position (-1 for final position).
+
+    The frame is generated in the background, and drawn by show_progress
+    once it is ready.
+    """
+    global wanted
+    if prefetcher is None:
+        return
+    wanted = pos
+    prefetcher.request(pos)
+    if not polling:
+        show_progress()
+
+def show_progress():
+    """Draws the wanted frame if it has been generated and shows what the
+    prefetcher is doing. Polls again later while there is work left."""
+    global wanted, polling
+    polling = False
+    if prefetcher is None:
+        return
     try:
-        f = frames[pos]
-        clear_canvas()
-        draw_shapes(f)
-        position.set(str(pos))
+        if wanted is not None:
+            f = prefetcher.get(wanted)
+            if f is not None:
+                if wanted < 0:
+                    wanted += prefetcher.length
+                draw_shapes(f)
+                position.set(str(wanted))
+                wanted = None
     except IndexError:
-        pass
+        wanted = None
+    except Exception as e:
+        progress.stop()
+        status.set('Error: %s' % str(e)[:40])
+        return
+    if prefetcher.length is None:
+        status.set('%d frames so far' % prefetcher.generated)
+    else:
+        status.set('of %d frames' % prefetcher.length)
+    if prefetcher.busy or wanted is not None:
+        progress.start()
+        polling = True
+        root.after(50, show_progress)
+    else:
+        progress.stop()
 
 root = Tk()
 
@@ -138,6 +257,12 @@ squarify.grid(column=0, row=0, sticky=(N, W, E))
 clear = ttk.Button(buttonframe, text='Clear', command = clear_canvas)
 clear.grid(column=0, row=1, sticky=(N, W, E))
 
+load = ttk.Button(buttonframe, text='Load frames', command = load_frames)
+load.grid(column=0, row=5, sticky=(N, W, E))
+
+save = ttk.Button(buttonframe, text='Save frames', command = save_frames)
+save.grid(column=0, row=6, sticky=(N, W, E))
+
 controlsframe = ttk.Frame(buttonframe)
 controlsframe.grid(column=0, row=2, sticky = (W, E))
 
@@ -166,6 +291,13 @@ end = ttk.Button(controlsframe, text='>>', command = lambda : jump_to_position(-
 end.state(['disabled'])
 end.grid(column=4, row=0, sticky = (N, S, W, E))
 
+status = StringVar()
+statuslabel = ttk.Label(buttonframe, textvariable=status)
+statuslabel.grid(column=0, row=3, sticky=(N, W, E))
+
+progress = ttk.Progressbar(buttonframe, mode='indeterminate', length=100)
+progress.grid(column=0, row=4, sticky=(N, W, E))
+
 root.bind('<Left>', lambda x : stepback.invoke())
 root.bind('<Right>', lambda x : stepforward.invoke())
 root.mainloop()
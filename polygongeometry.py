@@ -1,98 +1,1110 @@
 #!/usr/bin/env python3
 
+import bisect
+import operator
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import reduce
 from geometry import *
+from triangulation import triangulate
+
+def frame_delta(old, new):
+    """Return a compact description of how to turn the frame old into the
+    frame new.
+
+    Pieces are immutable, so a piece that appears in both frames is the same
+    object. The delta is a list of (keep, drop, add) triples: keep the next
+    'keep' pieces of old, skip the next 'drop' pieces of old and then add the
+    pieces in 'add'. Whatever is left of old after the last triple is kept.
+    """
+    position = {id(p): i for i, p in enumerate(old)}
+    delta = list()
+    keep = drop = 0
+    add = list()
+    j = 0
+    for p in new:
+        k = position.get(id(p), -1)
+        if k >= j and old[k] is p:
+            if add or k > j:
+                delta.append((keep, drop + k - j, tuple(add)))
+                keep = drop = 0
+                add = list()
+            keep += 1
+            j = k + 1
+        else:
+            add.append(p)
+    if add or j < len(old):
+        delta.append((keep, drop + len(old) - j, tuple(add)))
+    elif keep:
+        delta.append((keep, 0, ()))
+    return delta
+
+def apply_delta(old, delta):
+    """Return the frame created by applying delta (see frame_delta) to old"""
+    new = list()
+    i = 0
+    for keep, drop, add in delta:
+        new.extend(old[i:i + keep])
+        new.extend(add)
+        i += keep + drop
+    new.extend(old[i:])
+    return new
+
+# The names of the stages of FrameList._squarify
+STAGE_NAMES = ['triangulate', 'right angle', 'rectangle', 'square', 'merge']
+
+def frame_primitives(frame):
+    """Return the number of triangles (and polygons) in a frame"""
+    return sum(len(p) if isinstance(p, Shape) else 1 for p in frame)
+
+def _primitive_bytes():
+    """Return roughly how many bytes a Triangle and its points take"""
+    t = Triangle(((0.0, 0.0), (1.0, 0.0), (0.0, 1.0)))
+    return (sys.getsizeof(t) + sys.getsizeof(vars(t)) + sys.getsizeof(t.points)
+            + sum(sys.getsizeof(p) + 2 * sys.getsizeof(p[0])
+                  for p in t.points))
+
+# The size that FrameList counts for every triangle (or polygon) it keeps
+PRIMITIVE_BYTES = _primitive_bytes()
+
+def frame_bytes(frame):
+    """Return the approximate size of a frame (or any sequence of pieces),
+    with the triangles of its pieces"""
+    return sys.getsizeof(frame) + PRIMITIVE_BYTES * frame_primitives(frame)
+
+def delta_bytes(delta):
+    """Return the approximate size of a delta (see frame_delta), with the
+    triangles of the pieces it adds"""
+    return sys.getsizeof(delta) + sum(frame_bytes(a) for k, d, a in delta)
 
 class FrameList:
     """Acts like a lazy list that contains a snapshot of every step needed to
     square the polygon.
     
     The frame contains a generator that generates every step of the polygon,
-    and a list that contains everystep generated so far.
+    and a store of every step generated so far. Consecutive frames share
+    most of their pieces, so the frames are stored in blocks of
+    keyframe_interval frames: the first frame of a block (the keyframe) is
+    stored in full and every other frame is stored as a delta (see
+    frame_delta) from the frame before it.
+
+    By default every frame is kept. If max_frames or max_bytes is given, the
+    least recently used blocks are evicted once the store grows past that
+    limit. To get evicted frames back, the state of the generator is
+    checkpointed every checkpoint_interval frames, and the block is
+    regenerated from the nearest checkpoint before it. Checkpoints keep
+    their pieces alive, so they count towards max_bytes too, and the oldest
+    ones are dropped once only the newest block is left.
     """
     
-    def __init__(self, polygon):
-        """Creates a FrameList for polygon"""
+    def __init__(self, polygon, shape_type=Shape, keyframe_interval=64,
+                 max_frames=None, max_bytes=None, checkpoint_interval=None,
+                 merge_strategy='sequential', jobs=None,
+                 rectangle_strategy='squish', consolidate=False, stats=False,
+                 stage_hook=None, track_origins=False, pipeline_cache=None):
+        """Creates a FrameList for polygon
+
+        shape_type -- the Shape class used for the pieces of the polygon. Pass
+        arraygeometry.ArrayShape to keep the pieces in numpy arrays, or
+        meshgeometry.MeshShape to keep them as indexed meshes.
+        keyframe_interval -- the number of frames between frames that are
+        stored in full.
+        max_frames -- the maximum number of frames to store (None for no
+        limit).
+        max_bytes -- the maximum (approximate) size of the store and the
+        checkpoints in bytes (None for no limit). Every triangle of the
+        pieces they keep counts PRIMITIVE_BYTES, even though pieces are
+        shared between frames.
+        checkpoint_interval -- the number of frames between checkpoints of the
+        generator. Defaults to keyframe_interval when the store is bounded.
+        merge_strategy -- 'sequential' to fold every square into one growing
+        square, or 'balanced' to merge the squares in rounds, like a balanced
+        binary tree. Each round pairs the largest square left with the
+        smallest, so the merged squares have similar sizes.
+        jobs -- the number of processes to run stages 1 to 3 (which work on
+        every triangle separately) in. None runs everything in this process.
+        The frames are the same either way.
+        rectangle_strategy -- how stage 3 makes long rectangles short enough
+        to be slid into a square (see rectangle2square): 'squish' to halve
+        them repeatedly, or 'strips' to cut them into strips in one go.
+        consolidate -- if True, the triangles of every rectangle and every
+        square are joined into convex polygons (see geometry.consolidate)
+        after stages 2 and 3, so that the later stages cut fewer pieces. Only
+        works with shape_type Shape.
+        stats -- if True, keep statistics for every stage (see stats).
+        stage_hook -- a function that is called with the statistics of every
+        stage when it ends. Implies stats.
+        track_origins -- if True, every triangle (and polygon) keeps the
+        transform that moved it from the polygon (see Triangle), which is
+        what dissectionplan needs. Pieces with different origins are not
+        consolidated. Only works with shape_type Shape.
+        pipeline_cache -- a PipelineCache to share the steps of stages 1 to
+        3 between congruent pieces, or None to compute them for every piece.
+        It can be shared between FrameLists. It does not work with jobs or
+        track_origins.
+        """
+        if merge_strategy not in ('sequential', 'balanced'):
+            raise ValueError('Unknown merge strategy: ' + repr(merge_strategy))
+        if rectangle_strategy not in RECTANGLE_STRATEGIES:
+            raise ValueError('Unknown rectangle strategy: '
+                             + repr(rectangle_strategy))
+        if consolidate and shape_type is not Shape:
+            raise ValueError('Only Shape pieces can be consolidated')
+        if track_origins and shape_type is not Shape:
+            raise ValueError('Only Shape pieces can track their origins')
+        if pipeline_cache is not None and (jobs or track_origins):
+            raise ValueError('A pipeline cache does not work with jobs or '
+                             'track_origins')
         self._polygon = polygon
-        self._generator = self._squarify()
-        self._cache = list()
+        self._shape_type = shape_type
+        self._keyframe_interval = keyframe_interval
+        self._max_frames = max_frames
+        self._max_bytes = max_bytes
+        if checkpoint_interval is None and self.bounded:
+            checkpoint_interval = keyframe_interval
+        self._checkpoint_interval = checkpoint_interval
+        # Maps the number of a block to its keyframe and deltas, in least
+        # recently used order
+        self._blocks = OrderedDict()
+        self._block_bytes = dict()
+        self._stored_frames = 0
+        self._stored_bytes = 0
+        # States that _squarify can be resumed from. Resuming from
+        # _checkpoints[i] yields frame _checkpoint_indices[i] first.
+        self._checkpoints = [None]
+        self._checkpoint_indices = [0]
+        self._checkpoint_bytes = [0]
+        self._length = 0
+        # The number of frames, the final frame and the counters of the
+        # whole squaring, once they are known (see __len__)
+        self._total = None
+        self._final = None
+        self._final_counters = None
+        # The number of the first frame of every piece and the entry of the
+        # index (see _squarify) and the position of the piece in it, and the
+        # generator of the last seek with the number of its next frame (see
+        # _seek)
+        self._piece_firsts = None
+        self._pieces = None
+        self._seeking = None
+        # The last frame that was generated and the last frame that was
+        # rebuilt, as (index, frame) pairs
+        self._newest = None
+        self._current = None
+        self._merge_strategy = merge_strategy
+        self._rectangle_strategy = rectangle_strategy
+        self._consolidate = consolidate
+        self._track_origins = track_origins
+        self._pipeline_cache = pipeline_cache
+        self._counters = defaultdict(int)
+        self._jobs = jobs
+        self._stage = 0
+        self._stage_hook = stage_hook
+        self._stats = None
+        if stats or stage_hook is not None:
+            self._stats = list()
+            self._last_frame = None
+            self._start_stage(0)
+        self._generator = self._squarify(
+            checkpoint=self._checkpoint, counters=self._counters,
+            steps=self._pooled_steps if jobs else self._steps)
+
+    @property
+    def merge_operations(self):
+        """The total number of triangles that went into and came out of the
+        square merges generated so far. This is a measure of the work done by
+        the merge stage, for comparing merge strategies."""
+        return self._count('merge_operations')
+
+    @property
+    def consolidation(self):
+        """A pair (before, after) of the total number of primitives
+        (triangles and polygons) in the pieces that were consolidated so far
+        (in the whole squaring once len() has been taken), before and after
+        consolidation"""
+        return (self._count('consolidated_from'),
+                self._count('consolidated_to'))
+
+    def _count(self, name):
+        """Returns a counter of the frames generated so far, or of the whole
+        squaring once __len__ has squared the polygon in final mode"""
+        if self._final_counters is None:
+            return self._counters[name]
+        return max(self._counters[name], self._final_counters[name])
+
+    @property
+    def stats(self):
+        """A list with the statistics of every stage that has been reached,
+        or None if stats are not kept.
+
+        The statistics of a stage are a dict with its 'stage' number and
+        'name' (see STAGE_NAMES), the wall time spent generating its frames
+        ('seconds'), the number of 'frames', the number of triangles (and
+        polygons) in the last frame before the stage ('primitives_in') and
+        in its last frame so far ('primitives_out'), and the number of
+        Shape 'splits', convex 'hulls' and 'hull_cache_hits' (see
+        geometry.SHAPE_STATS). Work done in other processes (see jobs) is not
+        counted in the splits and hulls.
+        """
+        if self._stats is None:
+            return None
+        stats = [dict(s) for s in self._stats]
+        if self._stage_open:
+            stats[-1]['primitives_out'] = frame_primitives(self._last_frame or [])
+        return stats
+
+    @property
+    def generated(self):
+        """The number of frames generated (in order) so far"""
+        return self._length
+
+    @property
+    def bounded(self):
+        """True if old frames may be evicted from the store"""
+        return self._max_frames is not None or self._max_bytes is not None
 
     def __getitem__(self, i):
         """Returns the ith Frame
+
+        Once the number of frames is known (see __len__), a frame past the
+        block that is being generated is computed from the start of the
+        piece its block starts in (see _seek), without generating the frames
+        before it, and its block is stored like the blocks generated in
+        order.
         
         NOTE: the shape that is actively being worked on should be the last
         Shape in the frame
         """
-        while len(self._cache) <= i:
+        if i < 0:
+            i += len(self)
+            if i < 0:
+                raise IndexError('FrameList index out of bounds')
+        if self._total is not None and i >= self._total:
+            raise IndexError('FrameList index out of bounds')
+        if self._length <= i and self._final is not None and i == self._total - 1:
+            # The final frame is known, the frames before it can be
+            # generated later
+            return self._final[:]
+        b = i // self._keyframe_interval
+        if (self._pieces is not None
+                and b > self._length // self._keyframe_interval):
+            if b not in self._blocks:
+                return self._seek(i)
+            return self._rebuild(i)
+        while self._length <= i:
             try:
-                f = next(self._generator)
-                self._cache.append(f)
+                if self._stats is None:
+                    f = next(self._generator)
+                else:
+                    f = self._measured_next()
             except StopIteration:
+                self._total = self._length
                 raise IndexError('FrameList index out of bounds')
-        return self._cache[i]
+            self._store(f)
+        return self._rebuild(i)
+
+    def __len__(self):
+        """Returns the number of frames.
+
+        Unless every frame has been generated already, the first call squares
+        the polygon in final mode (see final_frame), which counts the frames
+        without building them and keeps the final frame, so that it can be
+        shown before the frames in between are generated. This is done in
+        this process, even if jobs is given.
+        """
+        if self._total is None:
+            counters = defaultdict(int)
+            index = list()
+            self._final = list(next(self._squarify(counters=counters,
+                                                   final=True, index=index)))
+            self._total = counters['frames']
+            self._final_counters = counters
+            self._piece_firsts = list()
+            self._pieces = list()
+            for entry in index:
+                for k, first in enumerate(entry[3]):
+                    self._piece_firsts.append(first)
+                    self._pieces.append((entry, k))
+        return self._total
+
+    def _seek(self, i):
+        """Returns the ith frame, generating only the frames from the start
+        of the piece that its block starts in.
+
+        Within stages 1 to 3 every piece is worked on independently, so the
+        state _squarify is in at the start of a piece is the pieces that
+        have not been worked on yet and the outputs of the pieces before it,
+        which are both kept in the index built by __len__. The merges of
+        stage 4 depend on each other, so seeking into stage 4 generates the
+        frames from the start of the stage. Going forward carries on from
+        the last seek.
+
+        Every block that is generated in full on the way, up to the block of
+        i, is stored (unless it is stored already), so that the frames
+        before i are not generated again when they are asked for.
+        """
+        interval = self._keyframe_interval
+        start = i - i % interval
+        end = min(start + interval, len(self))
+        p = bisect.bisect_right(self._piece_firsts, start) - 1
+        if (self._seeking is not None
+                and self._piece_firsts[p] <= self._seeking[0] <= start):
+            j, generator = self._seeking
+        else:
+            (stage, inputs, outputs, firsts, offsets), k = self._pieces[p]
+            state = (stage, inputs[:len(inputs) - k], outputs[:offsets[k]])
+            j, generator = firsts[k], self._squarify(state)
+        block = None
+        for frame in generator:
+            b, offset = divmod(j, interval)
+            frame = list(frame)
+            if offset == 0:
+                block = None
+                if b not in self._blocks:
+                    block = (frame, [None])
+                    size = frame_bytes(frame)
+            elif block is not None:
+                delta = frame_delta(previous, frame)
+                block[1].append(delta)
+                size += delta_bytes(delta)
+            previous = frame
+            if j == i:
+                result = frame
+            j += 1
+            if block is not None and (j % interval == 0 or j == len(self)):
+                self._blocks[b] = block
+                self._block_bytes[b] = size
+                self._stored_bytes += size
+                self._stored_frames += len(block[1])
+                block = None
+                self._evict()
+            if j == end:
+                self._seeking = (j, generator)
+                return result[:]
+        raise IndexError('FrameList index out of bounds')
+
+    def _measured_next(self):
+        """Generates the next frame, adding to the statistics of the stage"""
+        if not self._stage_open:
+            return next(self._generator)
+        self._measured_at = time.perf_counter()
+        self._measured_counts = dict(SHAPE_STATS)
+        try:
+            f = next(self._generator)
+        except StopIteration:
+            self._measure()
+            self._end_stage()
+            raise
+        self._measure()
+        self._stats[-1]['frames'] += 1
+        self._last_frame = f
+        return f
+
+    def _measure(self):
+        """Adds the time and the Shape counters since the last measurement
+        to the statistics of the current stage"""
+        now = time.perf_counter()
+        stats = self._stats[-1]
+        stats['seconds'] += now - self._measured_at
+        self._measured_at = now
+        for counter, key in (('split', 'splits'), ('hull', 'hulls'),
+                             ('hull_cached', 'hull_cache_hits')):
+            stats[key] += SHAPE_STATS[counter] - self._measured_counts[counter]
+        self._measured_counts = dict(SHAPE_STATS)
+
+    def _start_stage(self, stage):
+        """Starts the statistics of a stage"""
+        self._stats.append({
+            'stage': stage, 'name': STAGE_NAMES[stage], 'seconds': 0.0,
+            'frames': 0,
+            'primitives_in': self._stats[-1]['primitives_out'] if self._stats else 0,
+            'primitives_out': 0, 'splits': 0, 'hulls': 0, 'hull_cache_hits': 0})
+        self._stage_open = True
+
+    def _end_stage(self):
+        """Ends the statistics of the current stage and calls the stage
+        hook"""
+        if not self._stage_open:
+            return
+        self._stage_open = False
+        stats = self._stats[-1]
+        stats['primitives_out'] = frame_primitives(self._last_frame or [])
+        if self._stage_hook is not None:
+            self._stage_hook(dict(stats))
+
+    def _checkpoint(self, state):
+        """Called by _squarify with the state it can be resumed from, before
+        it computes the next frame"""
+        if state[0] != self._stage:
+            # This is the first piece of a new stage
+            self._stage = state[0]
+            if self._stats is not None:
+                self._measure()
+                self._end_stage()
+                self._start_stage(state[0])
+        last_index = self._checkpoint_indices[-1]
+        if (self._checkpoint_interval is not None
+                and self._length - last_index >= self._checkpoint_interval):
+            self._checkpoints.append(state)
+            self._checkpoint_indices.append(self._length)
+            size = (sys.getsizeof(state) + frame_bytes(state[1])
+                    + frame_bytes(state[2]))
+            self._checkpoint_bytes.append(size)
+            self._stored_bytes += size
+            self._evict()
+
+    def _store(self, frame):
+        """Adds the next frame to the store"""
+        frame = list(frame)
+        i = self._length
+        b, offset = divmod(i, self._keyframe_interval)
+        if offset == 0:
+            if b in self._blocks:
+                # The block was stored by _seek, these frames replace it
+                self._drop(b)
+            self._blocks[b] = (frame, [None])
+            size = frame_bytes(frame)
+        else:
+            delta = frame_delta(self._newest[1], frame)
+            self._blocks[b][1].append(delta)
+            size = delta_bytes(delta)
+        self._block_bytes[b] = self._block_bytes.get(b, 0) + size
+        self._stored_bytes += size
+        self._stored_frames += 1
+        self._newest = (i, frame)
+        self._length += 1
+        self._evict()
+
+    def _evict(self):
+        """Evicts least recently used blocks until the store is within its
+        limits. The block that is being filled is never evicted. If that is
+        not enough for max_bytes, the oldest checkpoints are dropped (apart
+        from the start of the generator)."""
+        newest_block = (self._length - 1) // self._keyframe_interval
+        while len(self._blocks) > 1 and (
+                (self._max_frames is not None
+                 and self._stored_frames > self._max_frames)
+                or (self._max_bytes is not None
+                    and self._stored_bytes > self._max_bytes)):
+            b = next(iter(self._blocks))
+            if b == newest_block:
+                self._blocks.move_to_end(b)
+                b = next(iter(self._blocks))
+            self._drop(b)
+        while (self._max_bytes is not None and len(self._checkpoints) > 1
+               and self._stored_bytes > self._max_bytes):
+            del self._checkpoints[1], self._checkpoint_indices[1]
+            self._stored_bytes -= self._checkpoint_bytes.pop(1)
+
+    def _drop(self, b):
+        """Removes block b from the store"""
+        keyframe, deltas = self._blocks.pop(b)
+        self._stored_frames -= len(deltas)
+        self._stored_bytes -= self._block_bytes.pop(b)
+        if (self._current is not None
+                and self._current[0] // self._keyframe_interval == b):
+            self._current = None
+
+    def _regenerate(self, b):
+        """Regenerates block b from the nearest checkpoint before it"""
+        k = b * self._keyframe_interval
+        end = min(k + self._keyframe_interval, self._length)
+        c = bisect.bisect_right(self._checkpoint_indices, k) - 1
+        j, state = self._checkpoint_indices[c], self._checkpoints[c]
+        previous = None
+        deltas = list()
+        for frame in self._squarify(state):
+            if j >= k:
+                frame = list(frame)
+                if j == k:
+                    keyframe = frame
+                    deltas.append(None)
+                else:
+                    deltas.append(frame_delta(previous, frame))
+                previous = frame
+            j += 1
+            if j == end:
+                break
+        self._blocks[b] = (keyframe, deltas)
+        self._block_bytes[b] = frame_bytes(keyframe) + sum(
+            delta_bytes(d) for d in deltas[1:])
+        self._stored_bytes += self._block_bytes[b]
+        self._stored_frames += len(deltas)
+
+    def _rebuild(self, i):
+        """Rebuilds the ith frame from the nearest keyframe before it"""
+        for cached in (self._newest, self._current):
+            if cached is not None and cached[0] == i:
+                return cached[1][:]
+        b, offset = divmod(i, self._keyframe_interval)
+        if b not in self._blocks:
+            self._regenerate(b)
+        self._blocks.move_to_end(b)
+        keyframe, deltas = self._blocks[b]
+        k = i - offset
+        j, frame = k, keyframe
+        if self._current is not None and k <= self._current[0] < i:
+            j, frame = self._current
+        while j < i:
+            j += 1
+            frame = apply_delta(frame, deltas[j - k])
+        self._current = (i, frame)
+        self._evict()
+        return frame[:]
 
     def _polygon2triangles(self):
         """Takes a list of points (polygon) and returns a list of Triangles
-        created by diagonalizing the polygon"""
-        polygon = self._polygon
-        common_point = polygon[0]
-        return [Triangle((common_point, p, q))
-                for p, q in zip(polygon[1:], polygon[2:])]
+        created by triangulating the polygon (see triangulation.triangulate)"""
+        triangles = triangulate(self._polygon)
+        if self._track_origins:
+            triangles = [Triangle(t.points, IDENTITY) for t in triangles]
+        return triangles
+
+    def _steps(self, stage, piece):
+        """Return the steps of stage 1, 2 or 3 for one piece.
+
+        Every step is a list of pieces that the piece is replaced with in
+        that step's frame. The pieces of the last step are the input to the
+        next stage. Stage 'consolidate' has one step with the consolidated
+        piece.
+        """
+        if self._pipeline_cache is not None:
+            return self._pipeline_cache.steps(
+                stage, piece, self._uncached_steps,
+                (self._shape_type, self._rectangle_strategy))
+        return self._uncached_steps(stage, piece)
+
+    def _uncached_steps(self, stage, piece):
+        """Like _steps, without the pipeline cache"""
+        if stage == 'consolidate':
+            return [[piece.consolidate()]]
+        elif stage == 1:
+            return [list(piece.to_rightangle())]
+        elif stage == 2:
+            return [[s] for s in triangle2rectangle(piece, self._shape_type)]
+        else:
+            return [[s] for s in rectangle2square(piece,
+                                                  self._rectangle_strategy)]
 
-    def _squarify(self):
+    def _start_pool(self, triangles):
+        """Send the stage 1 to 3 work for every triangle to a process pool.
+
+        The triangles are sent in the order that _squarify will take them, and
+        the results are collected in that order by _pooled_steps.
+        """
+        order = triangles[::-1]
+        chunksize = max(1, len(order) // (4 * self._jobs))
+        executor = ProcessPoolExecutor(self._jobs)
+        results = executor.map(_pooled_pipeline, order,
+                               [self._shape_type] * len(order),
+                               [self._rectangle_strategy] * len(order),
+                               [self._consolidate] * len(order),
+                               chunksize=chunksize)
+        # The work has been submitted, so the pool can shut down once it is
+        # done with it
+        executor.shutdown(wait=False)
+        self._pending = zip(order, results)
+        self._precomputed = dict()
+
+    def _pooled_steps(self, stage, piece):
+        """Like _steps, but take the steps from the process pool"""
+        steps = self._precomputed.pop(id(piece), None)
+        if steps is not None and steps[0] is piece:
+            return steps[1]
+        if stage == 1:
+            for triangle, result in self._pending:
+                if result is None:
+                    # The pipeline failed, recompute it here so that the
+                    # error is raised at the right frame
+                    continue
+                # The pool sends back copies of the triangles, so use the
+                # original as the key for the first step
+                result[0] = (triangle, result[0][1])
+                for p, steps in result:
+                    self._precomputed[id(p)] = (p, steps)
+                if triangle is piece:
+                    return self._precomputed.pop(id(piece))[1]
+        return self._steps(stage, piece)
+
+    def _squarify(self, state=None, checkpoint=None, counters=None,
+                  steps=None, final=False, index=None):
         """"A generator function that returns frames of converting a polygon
         to a square
 
+        state -- a state passed to checkpoint by an earlier run, to resume
+        from instead of starting from the polygon.
+        checkpoint -- a function that is called with the current state at
+        every point the generator can be resumed from.
+        counters -- a dict of counters (see FrameList.merge_operations) to
+        add to.
+        steps -- the function that computes the steps of stages 1 to 3 (see
+        _steps).
+        final -- if True, only the final frame is generated. The frames in
+        between are counted (in counters['frames']) instead of built.
+        index -- a list to add the pieces of every stage to in final mode, to
+        seek with (see FrameList._seek). An entry (stage, inputs, outputs,
+        firsts, offsets) has the pieces at the start and at the end of the
+        stage and, for every piece in the order they are worked on, the
+        number of its first frame and the number of outputs before it.
+
         NOTE: the shape that is actively being worked on should be the last
         Shape in the frame
         """
-        last = self._polygon2triangles()
-        yield last[:]
-        new_last = list()
-        # Turn all triangles to right-angled triangles
-        while len(last) > 0:
-            t = last.pop()
-            new_last.extend(t.to_rightangle())
-            yield last + new_last
-
-        # Turn all right-angled triangles to rectangles
-        last, new_last = new_last, list()
-        while len(last) > 0:
-            t = last.pop()
-            new_last.append(None)
-            for t in triangle2rectangle(t):
-                a = new_last.pop()
-                new_last.append(t)
-                yield last + new_last
+        if checkpoint is None:
+            checkpoint = lambda state: None
+        if counters is None:
+            counters = defaultdict(int)
+        if steps is None:
+            steps = self._steps
+        if state is None:
+            stage = 0
+        else:
+            stage, last, new_last = state
+            last, new_last = list(last), list(new_last)
 
-        # Turn all rectangles to squares
-        last, new_last = new_last, list()
-        while len(last) > 0:
-            s = last.pop()
-            new_last.append(None)
-            for r in rectangle2square(s):
-                new_last.pop()
-                new_last.append(r)
-                yield last + new_last
+        # In final mode, the final frame is last + new_last, unless the last
+        # frame was generated before the pieces were consolidated
+        unconsolidated = None
+        if stage == 0:
+            last = self._polygon2triangles()
+            if final:
+                counters['frames'] += 1
+            else:
+                yield last[:]
+            if steps == self._pooled_steps:
+                self._start_pool(last)
+            new_last = list()
+            stage = 1
+
+        # Stage 1 turns all triangles to right-angled triangles, stage 2 turns
+        # all right-angled triangles to rectangles and stage 3 turns all
+        # rectangles to squares
+        while stage < 4:
+            if index is not None:
+                inputs, firsts, offsets = tuple(last), list(), list()
+            while len(last) > 0:
+                checkpoint((stage, tuple(last), tuple(new_last)))
+                piece = last.pop()
+                piece_steps = steps(stage, piece)
+                if final:
+                    if index is not None:
+                        firsts.append(counters['frames'])
+                        offsets.append(len(new_last))
+                    counters['frames'] += len(piece_steps)
+                    unconsolidated = None
+                else:
+                    for step in piece_steps:
+                        yield last + new_last + step
+                step = piece_steps[-1]
+                new_last.extend(step)
+            if index is not None:
+                index.append((stage, inputs, tuple(new_last), firsts, offsets))
+            last, new_last = new_last, list()
+            if self._consolidate and stage in (2, 3):
+                if final and unconsolidated is None:
+                    unconsolidated = last[:]
+                pieces = [steps('consolidate', p)[0][0] for p in last]
+                counters['consolidated_from'] += sum(len(p) for p in last)
+                counters['consolidated_to'] += sum(len(p) for p in pieces)
+                last = pieces
+            stage += 1
+        if self._merge_strategy == 'balanced':
+            last = _by_area(last)
 
         # Merge all squares
-        last, new_last = new_last, list()
-        while len(last) > 1:
-            r, s = last.pop(), last.pop()
-            last.append(None)
-            for s in merge_squares(s, r):
-                last.pop()
-                last.append(s)
-                yield last[:]
-            q = last.pop()
-            q = q.translate((0, q.height().length()))
-            last.append(q)
-            yield last
+        balanced = self._merge_strategy == 'balanced'
+        if index is not None and len(last) + len(new_last) > 1:
+            # The merges depend on each other, so the whole stage is one
+            # entry
+            index.append((4, tuple(last), tuple(new_last),
+                          [counters['frames']], [len(new_last)]))
+        while len(last) + len(new_last) > 1:
+            if len(last) < 2:
+                # Start the next round of the balanced merge. Pairing the
+                # largest square with the smallest evens out the sizes, and
+                # merges the small squares, whose imprecision is largest
+                # for their size, into big ones like the sequential merge
+                last = _by_area(last + new_last)
+                new_last = list()
+            checkpoint((4, tuple(last), tuple(new_last)))
+            if balanced:
+                r, s = last.pop(), last.pop(0)
+            else:
+                r, s = last.pop(), last.pop()
+            for m in merge_squares(s, r):
+                if final:
+                    counters['frames'] += 1
+                else:
+                    yield last + new_last + [m]
+            # The side from the area, as the merged square is not exact
+            q = m.translate((0, math.sqrt(m.area())))
+            counters['merge_operations'] += len(r) + len(s) + len(q)
+            if balanced:
+                new_last.append(q)
+            else:
+                last.append(q)
+            if final:
+                counters['frames'] += 1
+                unconsolidated = None
+            else:
+                yield last + new_last
+        if final:
+            yield unconsolidated if unconsolidated is not None else last + new_last
+
+def final_frame(polygon, **options):
+    """Return the number of frames of squaring polygon and the final frame.
+
+    The dissection is the same as FrameList's, but the frames in between are
+    only counted, none of them are built. options are passed on to
+    FrameList.
+    """
+    frames = FrameList(polygon, **options)
+    return len(frames), frames[-1]
+
+def iter_frames(polygon, every=1, stage_ends=False, deltas=False, **options):
+    """Generate the frames of squaring polygon without storing them.
+
+    Unlike FrameList, frames are not kept once they have been generated, so
+    this runs in constant memory (apart from the frame being worked on). It
+    generates (index, frame) pairs for every 'every'th frame, or, if
+    stage_ends is True, for the last frame of every stage. The final frame is
+    always generated. If deltas is True the frames are replaced by deltas
+    (see frame_delta) from the previously generated frame, starting from an
+    empty frame.
+
+    options are passed on to FrameList.
+    """
+    frames = FrameList(polygon, **options)
+    stage = [0]
+    def checkpoint(state):
+        stage[0] = state[0]
+    steps = frames._pooled_steps if frames._jobs else frames._steps
+    generator = frames._squarify(checkpoint=checkpoint,
+                                 counters=frames._counters, steps=steps)
+    sent = list()
+    previous = None
+    for i, frame in enumerate(generator):
+        if previous is not None:
+            j, previous_stage, previous_frame = previous
+            if (previous_stage != stage[0] if stage_ends else j % every == 0):
+                yield (j, frame_delta(sent, previous_frame)
+                       if deltas else previous_frame)
+                sent = previous_frame
+        previous = (i, stage[0], frame)
+    if previous is not None:
+        j, previous_stage, previous_frame = previous
+        yield (j, frame_delta(sent, previous_frame)
+               if deltas else previous_frame)
+
+class FramePrefetcher:
+    """Generates the frames of a FrameList in a background thread.
+
+    FrameList is not thread safe, so once a FramePrefetcher is made for it,
+    the FrameList should only be used by the prefetcher. Anything else with
+    __len__, __getitem__ and generated (like framefile.FrameFile) works
+    too. request moves the prefetcher to a frame: that frame is generated
+    first, then the frames up to 'ahead' frames after it and 'behind'
+    frames before it, and then the number of frames (see
+    FrameList.__len__). get returns a frame that has been generated without
+    waiting for it, so a GUI can poll for it.
+
+    The pieces of a frame are shared with the frames the worker is still
+    generating, and Shapes apply their pending transform the first time
+    their triangles are asked for (see Shape.triangles), which is not
+    thread safe either. So the worker asks for the triangles of every Shape
+    before it hands a frame over, and after that the pieces are only read.
+
+    Frames before the requested one are usually in the FrameList's store
+    already, so by default none are prefetched.
+    """
+
+    def __init__(self, frames, ahead=32, behind=0):
+        self._frames = frames
+        self._ahead = ahead
+        self._behind = behind
+        self._condition = threading.Condition()
+        self._buffer = dict()
+        self._target = 0
+        self._closed = False
+        self.length = None
+        self.generated = 0
+        self.error = None
+        self.busy = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def request(self, i):
+        """Generate frame i (negative numbers count from the end) next and
+        prefetch the frames around it"""
+        with self._condition:
+            self._target = i
+            self._condition.notify()
+
+    def get(self, i):
+        """Return frame i if it has been generated, or None if it has not.
+
+        Raises IndexError if there is no frame i, and the error of the
+        worker if it failed.
+        """
+        with self._condition:
+            if self.error is not None:
+                raise self.error
+            if i < 0 and self.length is not None:
+                i += self.length
+            if self.length is not None and not 0 <= i < self.length:
+                raise IndexError('FrameList index out of bounds')
+            frame = self._buffer.get(i)
+            return None if frame is None else frame[:]
+
+    def close(self):
+        """Stop the worker thread once it has finished its current frame"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+    def _window(self):
+        """Return the numbers of the frames to generate, the most wanted
+        first"""
+        i = self._target
+        if i < 0:
+            if self.length is None:
+                return []
+            i += self.length
+        window = [i] + list(range(i + 1, i + self._ahead + 1)) + list(
+            range(i - 1, i - self._behind - 1, -1))
+        return [j for j in window if j >= 0 and (self.length is None
+                                                 or j < self.length)]
+
+    def _next_job(self):
+        """Return the number of the next frame to generate, 'length' to
+        find the number of frames, or None if there is nothing left to do.
+        Frames outside the window are dropped from the buffer."""
+        if self._target < 0 and self.length is None:
+            return 'length'
+        window = self._window()
+        for j in list(self._buffer):
+            if j not in window:
+                del self._buffer[j]
+        for j in window:
+            if j not in self._buffer:
+                return j
+        if self.length is None:
+            return 'length'
+        return None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                job = self._next_job()
+                while not self._closed and job is None:
+                    self.busy = False
+                    self._condition.wait()
+                    job = self._next_job()
+                if self._closed:
+                    return
+                self.busy = True
+            try:
+                if job == 'length':
+                    result = len(self._frames)
+                else:
+                    result = self._frames[job]
+                    for piece in result:
+                        if isinstance(piece, Shape):
+                            piece.triangles
+            except IndexError:
+                # The frames ran out before the number of frames was known
+                # (which is now known)
+                result = len(self._frames)
+                job = 'length'
+            except Exception as e:
+                with self._condition:
+                    self.error = e
+                    self.busy = False
+                return
+            with self._condition:
+                if job == 'length':
+                    self.length = result
+                else:
+                    self._buffer[job] = result
+                self.generated = self._frames.generated
+
+class PipelineCache:
+    """A cache of the steps of stages 1 to 3 (and of consolidation) of
+    pieces, shared by congruent pieces.
 
-def triangle2rectangle(tri):
+    A triangulated regular polygon has many congruent triangles, which
+    become congruent right-angled triangles, rectangles and squares. The
+    cache keys every piece by its shape: a triangle by its side lengths,
+    sorted, and a Shape by its triangles (and polygons) seen from the corner
+    of its convex hull that gives the smallest key, with every coordinate
+    rounded to a multiple of quantum. The steps are computed once, for the
+    first piece with a key moved to a canonical position, and moved onto
+    every piece with that key by the rigid transform (a rotation and
+    translation, and for triangles maybe a reflection) from the canonical
+    position to the piece.
+
+    The steps of a piece are the steps of a congruent piece, so the cuts can
+    be in other places (and the number of frames can differ) than without
+    the cache. Once steps are evicted, they are computed again for the next
+    piece with their key, which can move its cuts by up to quantum.
+
+    max_entries -- the number of pieces to keep the steps of.
+    eviction -- 'lru' to evict the least recently used steps first, or
+    'fifo' to evict the oldest.
+    quantum -- the size of the grid the coordinates of keys are rounded
+    to. It should be well below PRECISION, the distance at which points are
+    taken to be equal.
+    """
+
+    def __init__(self, max_entries=4096, eviction='lru', quantum=PRECISION**2):
+        if eviction not in ('lru', 'fifo'):
+            raise ValueError('Unknown eviction policy: ' + repr(eviction))
+        self._max_entries = max_entries
+        self._eviction = eviction
+        self._quantum = quantum
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def stats(self):
+        """A dict with the number of 'hits', 'misses' and 'evictions' so
+        far, and the number of 'entries'"""
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'entries': len(self._entries)}
+
+    def steps(self, stage, piece, compute, context=()):
+        """Return the steps of piece in stage.
+
+        compute(stage, piece) computes the steps of a piece that is not in
+        the cache. context is added to the key, for everything other than
+        the shape of the piece that changes the steps.
+        """
+        canonical = self._canonical(piece)
+        if canonical is None:
+            return compute(stage, piece)
+        key, matrix = canonical
+        key = (stage, context, key)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            # The first piece with a key, moved to where its canonical
+            # piece is, is the canonical piece of the key
+            entry = piece.transform(affine_inverse(matrix))
+            entry = (entry, compute(stage, entry))
+            self._entries[key] = entry
+            if len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        else:
+            self.hits += 1
+            if self._eviction == 'lru':
+                self._entries.move_to_end(key)
+        canonical_piece, steps = entry
+        # Move every piece once, so pieces that are in more than one step
+        # stay the same object, and the canonical piece becomes piece
+        moved = {id(canonical_piece): piece}
+        def move(p):
+            if id(p) not in moved:
+                moved[id(p)] = p.transform(matrix)
+            return moved[id(p)]
+        return [[move(p) for p in step] for step in steps]
+
+    def _canonical(self, piece):
+        """Return the key of piece and the transform from the canonical
+        piece of the key to piece. Returns None for pieces without area."""
+        if isinstance(piece, Triangle):
+            return self._canonical_triangle(piece)
+        return self._canonical_shape(piece)
+
+    def _canonical_triangle(self, triangle):
+        q = self._quantum
+        p = triangle.points
+        # The corners, ordered by the length of the side opposite them
+        sides = [math.hypot(p[(i + 2) % 3][0] - p[(i + 1) % 3][0],
+                            p[(i + 2) % 3][1] - p[(i + 1) % 3][1])
+                 for i in range(3)]
+        order = sorted(range(3), key=lambda i: sides[i])
+        a, b, c = (round(sides[i] / q) * q for i in order)
+        if c == 0:
+            return None
+        x = (b * b + c * c - a * a) / (2 * c)
+        if b * b - x * x <= 0:
+            return None
+        (x0, y0), (x1, y1), (x2, y2) = (p[i] for i in order)
+        angle = math.atan2(y1 - y0, x1 - x0)
+        cos, sin = math.cos(angle), math.sin(angle)
+        # The canonical triangle has its corner opposite the shortest side
+        # at the origin, its longest side along the x axis and its last
+        # corner above it, so a triangle that is clockwise is reflected
+        flip = -1 if (x1 - x0) * (y2 - y0) - (x2 - x0) * (y1 - y0) < 0 else 1
+        matrix = (cos, -sin * flip, x0, sin, cos * flip, y0)
+        return ('triangle', a, b, c), matrix
+
+    def _canonical_shape(self, shape):
+        q = self._quantum
+        hull = shape.convex_hull()
+        if len(hull) < 3:
+            return None
+        primitives = shape.triangles
+        best = None
+        for i, (x0, y0) in enumerate(hull):
+            x1, y1 = hull[(i + 1) % len(hull)]
+            angle = math.atan2(y1 - y0, x1 - x0)
+            cos, sin = math.cos(angle), math.sin(angle)
+            key = tuple(tuple((round((cos * (x - x0) + sin * (y - y0)) / q),
+                               round((cos * (y - y0) - sin * (x - x0)) / q))
+                              for x, y in t.points) for t in primitives)
+            if best is None or key < best[0]:
+                best = (key, (cos, -sin, x0, sin, cos, y0))
+        key, matrix = best
+        return (type(shape), key), matrix
+
+def triangle_pipeline(triangle, shape_type=Shape, rectangle_strategy='squish',
+                      consolidate=False):
+    """Runs stages 1 to 3 of FrameList._squarify on one triangle.
+
+    Returns a list of (piece, steps) pairs (see FrameList._steps) for the
+    triangle, its right-angled triangles and their rectangles. If
+    consolidate is True, the rectangles are consolidated before stage 3 and
+    the list also has a (piece, [[consolidated piece]]) pair for every
+    rectangle and square.
+    """
+    rights = triangle.to_rightangle()
+    result = [(triangle, [list(rights)])]
+    for right in rights:
+        rect_steps = [[s] for s in triangle2rectangle(right, shape_type)]
+        result.append((right, rect_steps))
+        rect = rect_steps[-1][0]
+        if consolidate:
+            result.append((rect, [[rect.consolidate()]]))
+            rect = result[-1][1][0][0]
+        square_steps = [[s] for s in rectangle2square(rect, rectangle_strategy)]
+        result.append((rect, square_steps))
+        square = square_steps[-1][0]
+        if consolidate and square is not rect:
+            result.append((square, [[square.consolidate()]]))
+    return result
+
+def _pooled_pipeline(triangle, shape_type, rectangle_strategy, consolidate):
+    """Runs triangle_pipeline in a worker process, returning None if it
+    fails"""
+    try:
+        return triangle_pipeline(triangle, shape_type, rectangle_strategy,
+                                 consolidate)
+    except Exception:
+        return None
+
+def triangle2rectangle(tri, shape_type=Shape):
     """Turns a right angle triangle into a rectangle (Shape).
     
     This function is a generator function that generates a Shape for every step
-    needed to turn the triangle into a rectangle.
+    needed to turn the triangle into a rectangle. The shapes are instances of
+    shape_type.
     """
     p = tri.points
     # The point at right angle
@@ -106,12 +1118,12 @@ def triangle2rectangle(tri):
     midp = height.midpoint()
     rect_side = base.to_line().parallel(midp)
     other_point = line_intersects_segment(rect_side, hyp)
-    t1 = Triangle((p[other[0]], midp, other_point))
-    t2 = Triangle((p[right], p[other[1]], midp))
-    t3 = Triangle((p[other[1]], midp, other_point))
-    yield Shape([t1, t2, t3])
+    t1 = Triangle((p[other[0]], midp, other_point), tri.origin)
+    t2 = Triangle((p[right], p[other[1]], midp), tri.origin)
+    t3 = Triangle((p[other[1]], midp, other_point), tri.origin)
+    yield shape_type([t1, t2, t3])
     t1 = t1.rotate(other_point, math.pi)
-    yield Shape([t1, t2, t3])
+    yield shape_type([t1, t2, t3])
 
 def squish_rectangle(self):
     """Return a rectangle of equal area such that height / width < 2"""
@@ -120,11 +1132,13 @@ def squish_rectangle(self):
     s2 = LineSegment(b, c)
     width = s1 if s1.length() < s2.length() else s2
     height = s2 if s1.length() < s2.length() else s1
-    if height.length() > 2 * width.length():
+    # A rectangle that is 2:1 up to rounding is short enough, or it would
+    # be cut into another 2:1 rectangle
+    if height.length() > 2 * width.length() + PRECISION:
         midp = height.midpoint()
         cut = height.to_line().perpendicular(midp)
         rec1, rec2 = self.split(cut)
-        yield Shape(rec1.triangles + rec2.triangles)
+        yield rec1 + rec2
         h1 = rec1.convex_hull()
         h2 = rec2.convex_hull()
         common = None
@@ -137,17 +1151,87 @@ def squish_rectangle(self):
                 continue
             break
         rec1 = rec1.rotate(common, math.pi)
-        s = Shape(rec1.triangles + rec2.triangles)
+        s = rec1 + rec2
         yield s
         for t in squish_rectangle(s):
             yield t
     else:
         yield self
 
+def _fan(polygon, origin=None):
+    """Return the triangles of a fan triangulation of the convex polygon,
+    with the given origin (see Triangle)"""
+    points = [p for i, p in enumerate(polygon) if not point_eq(p, polygon[i - 1])]
+    return [Triangle((points[0], points[i], points[i + 1]), origin)
+            for i in range(1, len(points) - 1)]
+
+def strip_rectangle(rectangle):
+    """Return a rectangle of equal area such that height / width <= 2.
+
+    Unlike squish_rectangle, which halves the rectangle until it is short
+    enough, the rectangle is cut into k strips across its height in one go
+    and the strips are stacked side by side. k is the smallest number with
+    height / (k**2 * width) <= 2 (within PRECISION). Every triangle is
+    clipped to the strips it overlaps and each part is triangulated again,
+    so a triangle that crosses m cuts becomes at most 3 * (m + 1) triangles
+    however many cuts there are.
+
+    This function is a generator function like squish_rectangle. It yields
+    the cut rectangle and then the stacked strips.
+    """
+    a, b, c, d = rectangle.convex_hull()
+    if LineSegment(a, b).length() < LineSegment(b, c).length():
+        # Ensure a to b is the height and b to c is the width
+        a, b, c, d = b, c, d, a
+    height = LineSegment(a, b)
+    width = LineSegment(b, c)
+    # Within PRECISION, like squish_rectangle, so that a rectangle that is
+    # 2:1 up to rounding is not cut
+    k = math.ceil(math.sqrt((height.length() - PRECISION)
+                            / width.length() / 2))
+    if k <= 1:
+        yield rectangle
+        return
+    strip_height = height.length() / k
+    (ax, ay), (bx, by), (cx, cy) = a, b, c
+    ux, uy = (bx - ax) / height.length(), (by - ay) / height.length()
+    cuts = [height.to_line().perpendicular(
+        height.point_by_length(i * strip_height)) for i in range(1, k)]
+    below = cuts[0].side_of_line(a)
+    strips = [list() for i in range(k)]
+    for t in rectangle.triangles:
+        along = [((x - ax) * ux + (y - ay) * uy) / strip_height
+                 for x, y in t.points]
+        first = min(max(int(math.floor(min(along))), 0), k - 1)
+        last = min(max(int(math.floor(max(along))), 0), k - 1)
+        polygon = list(t.points)
+        for i in range(first, last):
+            strips[i].extend(_fan(clip_polygon(polygon, cuts[i], below),
+                                  t.origin))
+            polygon = clip_polygon(polygon, cuts[i], -below)
+        strips[last].extend(_fan(polygon, t.origin) if first < last else [t])
+    shape_type = type(rectangle)
+    strips = [shape_type(s) for s in strips]
+    yield reduce(operator.add, strips)
 
-def rectangle2square(rectangle):
-    """Return a square of equal area to the rectangle. """
-    rect = squish_rectangle(rectangle)
+    # Strip i moves down by i strips and across by i widths
+    down = ((ax - bx) / k, (ay - by) / k)
+    across = (cx - bx, cy - by)
+    strips = [s.translate((i * (down[0] + across[0]), i * (down[1] + across[1])))
+              for i, s in enumerate(strips)]
+    yield reduce(operator.add, strips)
+
+# The ways that rectangle2square can make a rectangle short enough to slide
+RECTANGLE_STRATEGIES = {'squish': squish_rectangle, 'strips': strip_rectangle}
+
+def rectangle2square(rectangle, strategy='squish'):
+    """Return a square of equal area to the rectangle.
+
+    The rectangle is first made short enough with the function in
+    RECTANGLE_STRATEGIES named by strategy, and then cut in three and slid
+    into a square.
+    """
+    rect = RECTANGLE_STRATEGIES[strategy](rectangle)
     last = None
     for t in rect:
         if last is not None:
@@ -158,7 +1242,8 @@ def rectangle2square(rectangle):
     s1 = LineSegment(a, b)
     s2 = LineSegment(b, c)
     if float_eq(s1.length(), s2.length()):
-        yield self
+        yield rect
+        return
     elif s1.length() < s2.length():
         # Ensure s1 is height and s2 is width
         a, b, c, d = b, c, d, a
@@ -182,7 +1267,7 @@ def rectangle2square(rectangle):
     else:
         raise Exception("Bad cut")
 
-    yield Shape(triangle.triangles + rest.triangles)
+    yield triangle + rest
 
     cut = s1.to_line().perpendicular(corner1)
     r1, r2 = rest.split(cut)
@@ -195,7 +1280,7 @@ def rectangle2square(rectangle):
     else:
         raise Exception("Bad cut")
 
-    yield Shape(triangle.triangles + rest.triangles + other_triangle.triangles)
+    yield triangle + rest + other_triangle
 
     for p in triangle.convex_hull():
         if not point_eq(p, b) and not point_eq(p, c):
@@ -203,32 +1288,39 @@ def rectangle2square(rectangle):
 
     tri_trans = (corner2[0] - anchor[0], corner2[1] - anchor[1])
     triangle = triangle.translate(tri_trans)
-    yield Shape(triangle.triangles + rest.triangles + other_triangle.triangles)
+    yield triangle + rest + other_triangle
     otri_trans = (anchor[0] - b[0], anchor[1] - b[1])
     other_triangle = other_triangle.translate(otri_trans)
-    yield Shape(rest.triangles + triangle.triangles + other_triangle.triangles)
+    yield rest + triangle + other_triangle
+
 
+def _by_area(squares):
+    """Return the squares sorted by area. The areas are rounded to PRECISION
+    and squares of the same area keep their order, so that float noise does
+    not decide how the balanced merge pairs them up"""
+    keyed = sorted((round(s.area() / PRECISION), i, s)
+                   for i, s in enumerate(squares))
+    return [s for area, i, s in keyed]
 
 def merge_squares(self, square):
     """Takes this square and another square and returns a bigger square of
     equal area."""
     # Make sure it's a square
     s1, s2 = self.orientate(), square.orientate()
-    yield Shape(s1.triangles + s2.triangles)
+    yield s1 + s2
 
     assert float_eq(s1.height().length(), s1.width().length())
     assert float_eq(s2.height().length(), s2.width().length())
 
-    tmp = s1 if s1.height().length() > s2.height().length() else s2
-    s2 = s2 if s1.height().length() > s2.height().length() else s1
-    s1 = tmp
+    if s1.area() < s2.area():
+        s1, s2 = s2, s1
 
     right_most = sorted(s1.convex_hull(), key=cmp_to_key(point_cmp))[3]
     left_most =  sorted(s2.convex_hull(), key=cmp_to_key(point_cmp))[1]
 
     t = (right_most[0] - left_most[0], right_most[1] - left_most[1])
     s2 = s2.translate(t)
-    yield Shape(s1.triangles + s2.triangles)
+    yield s1 + s2
 
     a1, b1, c1, d1 = sorted(s1.convex_hull(), key=cmp_to_key(point_cmp))
     a2, b2, c2, d2 = sorted(s2.convex_hull(), key=cmp_to_key(point_cmp))
@@ -237,7 +1329,7 @@ def merge_squares(self, square):
     cut_point = (b1[0] + l2, b1[1])
     cut1 = LineSegment(a1, cut_point).to_line()
     cut2 = LineSegment(c2, cut_point).to_line()
-    combined = Shape(s1.triangles + s2.triangles)
+    combined = s1 + s2
     ns1, ns2 = combined.split(cut1)
 
     if len(ns1.convex_hull()) == 3:
@@ -249,10 +1341,10 @@ def merge_squares(self, square):
     else:
         raise Exception("Bad cut" + str(ns1.convex_hull()) + str(ns2.convex_hull()))
     
-    yield Shape(triangle.triangles + rest.triangles)
+    yield triangle + rest
 
     triangle = triangle.rotate(a1, math.pi / 2)
-    combined = Shape(triangle.triangles + rest.triangles)
+    combined = triangle + rest
     yield(combined)
 
     ns1, ns2 = combined.split(cut2)
@@ -266,8 +1358,8 @@ def merge_squares(self, square):
     else:
         raise Exception("Bad cut" + str(ns1.convex_hull()) + str(ns2.convex_hull()))
 
-    yield Shape(triangle.triangles + rest.triangles)
+    yield triangle + rest
     
     triangle = triangle.rotate(c2, math.pi / 2 * 3)
-    combined = Shape(triangle.triangles + rest.triangles)
+    combined = triangle + rest
     yield combined
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""A cache of dissection plans on disk.
+
+Polygons that only differ by a translation, a rotation or a uniform scale
+are squared by the same plan (see dissectionplan), so the cache stores the
+plan of a canonical polygon and maps it onto every polygon of the same
+shape. The canonical polygon of a polygon (see canonicalize) has its
+centroid at the origin and a fixed area, and starts at the vertex furthest
+from the centroid, which lies on the positive x axis. Its coordinates,
+rounded to a quantum, are the key of the cache.
+
+The plans are stored as JSON files in a directory, which is kept under
+max_bytes by removing the least recently used plans.
+
+Example:
+
+    cache = ResultCache('plans')
+    square = cache.plan(polygon).square()
+    print(cache.stats)
+"""
+
+import hashlib
+import json
+import math
+import os
+import tempfile
+from collections import OrderedDict
+
+from dissectionplan import DissectionPlan, dissection_plan
+
+# The FrameList options that change the plan of a polygon, and are part of
+# its key
+RESULT_OPTIONS = ('merge_strategy', 'rectangle_strategy', 'consolidate')
+
+def polygon_centroid(polygon):
+    """Return the signed area and the centroid of a polygon"""
+    area = cx = cy = 0.0
+    for i, (x1, y1) in enumerate(polygon):
+        x0, y0 = polygon[i - 1]
+        cross = x0 * y1 - x1 * y0
+        area += cross
+        cx += (x0 + x1) * cross
+        cy += (y0 + y1) * cross
+    area *= 0.5
+    if area == 0:
+        return 0.0, None
+    return area, (cx / (6 * area), cy / (6 * area))
+
+def canonicalize(polygon, quantum=2**-20, size=1000.0):
+    """Return the canonical polygon of a polygon, the similarity transform
+    that maps the canonical polygon onto the polygon, and the key of the
+    canonical polygon.
+
+    The canonical polygon has its centroid at the origin and an area of
+    size**2, its points are in counter clockwise order and its first point
+    is on the positive x axis. Of the points furthest from the centroid
+    (within quantum, relative to the size) the one that gives the smallest
+    key is the first point. The key is the canonical points rounded to
+    multiples of quantum * size.
+
+    Returns None for a polygon without area.
+    """
+    area, centroid = polygon_centroid(polygon)
+    if centroid is None:
+        return None
+    scale = size / math.sqrt(abs(area))
+    cx, cy = centroid
+    centred = [((x - cx) * scale, (y - cy) * scale) for x, y in polygon]
+    if area < 0:
+        # The same polygon in clockwise order has the same key
+        centred.reverse()
+    step = quantum * size
+    radii = [round(math.hypot(x, y) / step) for x, y in centred]
+    furthest = max(radii)
+    best = None
+    for i, r in enumerate(radii):
+        if r != furthest:
+            continue
+        x, y = centred[i]
+        angle = math.atan2(y, x)
+        c, s = math.cos(angle), math.sin(angle)
+        points = [(c * x + s * y, c * y - s * x)
+                  for x, y in centred[i:] + centred[:i]]
+        key = tuple((round(x / step), round(y / step)) for x, y in points)
+        if best is None or key < best[0]:
+            best = (key, points, angle)
+    key, points, angle = best
+    # Rotate back, scale back and move back to the centroid
+    c, s = math.cos(angle), math.sin(angle)
+    matrix = (c / scale, -s / scale, cx, s / scale, c / scale, cy)
+    return points, matrix, key
+
+class ResultCache:
+    """A cache of dissection plans, stored as files in directory.
+
+    Every file is a plan for a canonical polygon (see canonicalize), so one
+    entry serves every translated, rotated or uniformly scaled copy of the
+    polygon. A polygon that is not in the cache is squared in its canonical
+    form, so every copy is cut the same way. Once the files take more than
+    max_bytes, the least recently used ones are removed.
+    """
+
+    def __init__(self, directory, max_bytes=64 * 2**20, quantum=2**-20,
+                 size=1000.0):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._quantum = quantum
+        self._size = size
+        os.makedirs(directory, exist_ok=True)
+        # The size of every file, least recently used first
+        self._entries = OrderedDict()
+        files = list()
+        for name in os.listdir(directory):
+            if name.endswith('.json'):
+                stat = os.stat(os.path.join(directory, name))
+                files.append((stat.st_mtime, name, stat.st_size))
+        for mtime, name, size in sorted(files):
+            self._entries[name] = size
+        self._bytes = sum(self._entries.values())
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._shrink()
+
+    @property
+    def stats(self):
+        """A dict with the number of 'hits', 'misses' and 'evictions' so
+        far, and the number of 'entries' and 'bytes' in the cache"""
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'entries': len(self._entries),
+                'bytes': self._bytes}
+
+    def plan(self, polygon, **options):
+        """Return the dissection plan (see dissectionplan) of polygon.
+
+        options are passed on to FrameList when the plan is not in the
+        cache. Polygons without area are squared without the cache.
+        """
+        canonical = canonicalize(polygon, self._quantum, self._size)
+        if canonical is None:
+            return dissection_plan(polygon, **options)
+        points, matrix, key = canonical
+        name = self._name(key, options)
+        plan = self._load(name)
+        if plan is None:
+            self.misses += 1
+            plan = dissection_plan(points, **options)
+            self._store(name, plan)
+        else:
+            self.hits += 1
+        return plan.transformed(matrix)
+
+    def clear(self):
+        """Remove every plan from the cache"""
+        for name in list(self._entries):
+            self._remove(name)
+
+    def _name(self, key, options):
+        """Return the file name of a key with the options that change the
+        plan"""
+        options = [(o, options[o]) for o in RESULT_OPTIONS if o in options]
+        digest = hashlib.sha1(repr((key, options)).encode()).hexdigest()
+        return digest + '.json'
+
+    def _load(self, name):
+        """Return the plan in the file name, or None if it is not cached.
+        Files written by other caches on the same directory are found
+        too."""
+        path = os.path.join(self._directory, name)
+        try:
+            with open(path) as f:
+                data = f.read()
+            plan = DissectionPlan.from_dict(json.loads(data))
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            # Not cached, removed by another cache, or damaged
+            self._forget(name)
+            return None
+        if name not in self._entries:
+            self._entries[name] = len(data)
+            self._bytes += len(data)
+        self._entries.move_to_end(name)
+        return plan
+
+    def _store(self, name, plan):
+        """Write plan to the file name and remove the least recently used
+        files until the cache is small enough"""
+        data = json.dumps(plan.as_dict()).encode()
+        if len(data) > self._max_bytes:
+            return
+        # Write to a temporary file first, so that readers never see half a
+        # plan
+        fd, tmp = tempfile.mkstemp(dir=self._directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, os.path.join(self._directory, name))
+        self._forget(name)
+        self._entries[name] = len(data)
+        self._bytes += len(data)
+        self._shrink()
+
+    def _shrink(self):
+        """Remove the least recently used files until the cache is within
+        max_bytes"""
+        while self._bytes > self._max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, name):
+        """Remove the file name from the cache"""
+        try:
+            os.remove(os.path.join(self._directory, name))
+        except FileNotFoundError:
+            pass
+        self._forget(name)
+
+    def _forget(self, name):
+        """Drop name from the entries, if it is there"""
+        size = self._entries.pop(name, None)
+        if size is not None:
+            self._bytes -= size
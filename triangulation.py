@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+"""Triangulation of simple polygons.
+
+The polygon is split into y-monotone pieces with a sweep line (see de Berg
+et al., Computational Geometry, chapter 3), every monotone piece is
+triangulated in linear time, and then diagonals are flipped until the
+triangulation is (constrained) Delaunay, which removes most slivers. A
+second sweep (Shamos and Hoey's) first checks that the polygon is simple.
+
+The sweeps make O(n log n) orientation tests, but the edges crossed by the
+sweep line are kept in a Python list, so every insertion and removal also
+shifts up to all of them: O(n^2) in the worst case (when the sweep line
+crosses O(n) edges), although the shifting is a memmove that costs little
+next to the orientation tests. At most n^2 diagonals are flipped.
+
+Running this module benchmarks the triangulation on random polygons.
+"""
+
+import math
+from geometry import Triangle
+
+def _cross(o, a, b):
+    """Twice the signed area of the triangle o, a, b (> 0 if counter
+    clockwise)"""
+    return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+def _height(p):
+    """Sort key that orders points from the top of the sweep to the bottom.
+
+    Points with equal y are ordered as if the plane were rotated slightly, so
+    that no two points are at the same height.
+    """
+    return (-p[1], p[0])
+
+def _clean(polygon):
+    """Return the polygon in counter clockwise order without repeated or
+    collinear points. Raises ValueError if fewer than 3 points are left"""
+    points = list()
+    for p in polygon:
+        p = (float(p[0]), float(p[1]))
+        if not points or p != points[-1]:
+            points.append(p)
+    while len(points) > 1 and points[0] == points[-1]:
+        points.pop()
+    changed = True
+    while changed and len(points) > 2:
+        changed = False
+        kept = list()
+        n = len(points)
+        for i, p in enumerate(points):
+            a, b = points[i - 1], points[(i + 1) % n]
+            scale = abs(a[0] - p[0]) + abs(a[1] - p[1]) + abs(b[0] - p[0]) + abs(b[1] - p[1])
+            if abs(_cross(a, p, b)) <= 1e-12 * scale * scale:
+                changed = True
+            else:
+                kept.append(p)
+        points = kept
+    if len(points) < 3:
+        raise ValueError('polygon is not simple')
+    area = sum(_cross((0, 0), p, q) for p, q in zip(points, points[1:] + points[:1]))
+    if area < 0:
+        points.reverse()
+    return points
+
+class _Status:
+    """The edges crossed by the sweep line, ordered from left to right.
+
+    An edge is a pair (i, j) of point indices with point i above point j.
+    Edges are found by binary search with an orientation test against the
+    point being swept, so only edges that are crossed by the sweep line at
+    that point can be compared. The search is O(log k) for k edges, but
+    inserting or removing an edge shifts the edges after it in the list,
+    which is O(k).
+    """
+
+    def __init__(self, points):
+        self.points = points
+        self.edges = list()
+
+    def _left_of(self, edge, p, tie=None):
+        """True if the edge is to the left of point p. If p is on the edge,
+        True if the edge is to the left of point tie instead"""
+        a, b = self.points[edge[0]], self.points[edge[1]]
+        side = _cross(a, b, p)
+        if side == 0 and tie is not None:
+            side = _cross(a, b, tie)
+        return side > 0
+
+    def _position(self, p, tie=None):
+        """Return the number of edges that are to the left of p (see
+        _left_of)"""
+        lo, hi = 0, len(self.edges)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._left_of(self.edges[mid], p, tie):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def insert(self, edge):
+        """Insert the edge that starts at the point being swept and return
+        its position. Edges that start at the same point are ordered by
+        their lower points"""
+        i = self._position(self.points[edge[0]], self.points[edge[1]])
+        self.edges.insert(i, edge)
+        return i
+
+    def remove(self, edge):
+        """Remove the edge that ends at the point being swept and return the
+        position it had. Edges that end at the same point are ordered by
+        their upper points"""
+        i = self._position(self.points[edge[1]], self.points[edge[0]])
+        if i >= len(self.edges) or self.edges[i] != edge:
+            i = self.edges.index(edge)
+        del self.edges[i]
+        return i
+
+    def left_of(self, p):
+        """Return the edge directly to the left of p"""
+        i = self._position(p)
+        if i == 0:
+            # Only a polygon that crosses itself has nothing to the left of
+            # a vertex that needs a helper
+            raise ValueError('polygon is not simple')
+        return self.edges[i - 1]
+
+def _meet(points, e, f):
+    """True if the edges e and f (pairs of point indices) meet, at a
+    crossing or where one touches the other"""
+    p1, p2 = points[e[0]], points[e[1]]
+    p3, p4 = points[f[0]], points[f[1]]
+    d1, d2 = _cross(p3, p4, p1), _cross(p3, p4, p2)
+    d3, d4 = _cross(p1, p2, p3), _cross(p1, p2, p4)
+    if (d1 > 0 > d2 or d1 < 0 < d2) and (d3 > 0 > d4 or d3 < 0 < d4):
+        return True
+
+    def within(a, b, p):
+        return (min(a[0], b[0]) <= p[0] <= max(a[0], b[0])
+                and min(a[1], b[1]) <= p[1] <= max(a[1], b[1]))
+    return ((d1 == 0 and within(p3, p4, p1)) or
+            (d2 == 0 and within(p3, p4, p2)) or
+            (d3 == 0 and within(p1, p2, p3)) or
+            (d4 == 0 and within(p1, p2, p4)))
+
+def _check_simple(points):
+    """Raise ValueError if two edges of the polygon points meet anywhere
+    other than at the point that neighbouring edges share.
+
+    This is Shamos and Hoey's sweep: the first place that edges meet is
+    between two edges that are next to each other on the sweep line at some
+    point, so only edges that become neighbours are checked.
+    """
+    n = len(points)
+    if len(set(points)) < n:
+        # The edges at a repeated point can all share points with their
+        # neighbours on the sweep line, so the sweep would not see it
+        raise ValueError('polygon is not simple')
+    order = sorted(range(n), key=lambda i: _height(points[i]))
+    above = [None] * n
+    for rank, i in enumerate(order):
+        above[i] = -rank
+
+    status = _Status(points)
+    edges = status.edges
+
+    def check(k):
+        """Check the edges at positions k - 1 and k of the status"""
+        if 0 < k < len(edges):
+            e, f = edges[k - 1], edges[k]
+            if set(e).isdisjoint(f) and _meet(points, e, f):
+                raise ValueError('polygon is not simple')
+
+    for i in order:
+        ends = [j for j in ((i - 1) % n, (i + 1) % n) if above[j] > above[i]]
+        for j in ends:
+            check(status.remove((j, i)))
+        for j in ((i - 1) % n, (i + 1) % n):
+            if j not in ends:
+                k = status.insert((i, j))
+                check(k)
+                check(k + 1)
+
+def _monotone_diagonals(points):
+    """Return the diagonals that split the counter clockwise polygon points
+    into y-monotone pieces"""
+    n = len(points)
+    order = sorted(range(n), key=lambda i: _height(points[i]))
+    above = [None] * n
+    for rank, i in enumerate(order):
+        above[i] = -rank
+
+    status = _Status(points)
+    helper = dict()
+    merge = set()
+    diagonals = list()
+
+    def edge(i):
+        return (i, (i + 1) % n)
+
+    def fix_up(i, e):
+        """Add a diagonal to the helper of e if it is a merge vertex"""
+        if helper[e] in merge:
+            diagonals.append((i, helper[e]))
+
+    for i in order:
+        prev, next = (i - 1) % n, (i + 1) % n
+        p = points[i]
+        convex = _cross(points[prev], p, points[next]) > 0
+        prev_below = above[prev] < above[i]
+        next_below = above[next] < above[i]
+        if prev_below and next_below:
+            if convex:
+                # Start vertex
+                status.insert(edge(i))
+                helper[edge(i)] = i
+            else:
+                # Split vertex
+                e = status.left_of(p)
+                diagonals.append((i, helper[e]))
+                helper[e] = i
+                status.insert(edge(i))
+                helper[edge(i)] = i
+        elif not prev_below and not next_below:
+            fix_up(i, edge(prev))
+            status.remove(edge(prev))
+            if not convex:
+                # Merge vertex
+                merge.add(i)
+                e = status.left_of(p)
+                fix_up(i, e)
+                helper[e] = i
+        elif not prev_below:
+            # Regular vertex with the interior of the polygon to the right
+            fix_up(i, edge(prev))
+            status.remove(edge(prev))
+            status.insert(edge(i))
+            helper[edge(i)] = i
+        else:
+            # Regular vertex with the interior of the polygon to the left
+            e = status.left_of(p)
+            fix_up(i, e)
+            helper[e] = i
+    return diagonals
+
+def _faces(points, diagonals):
+    """Return the pieces (as lists of point indices in counter clockwise
+    order) that the diagonals cut the polygon into"""
+    n = len(points)
+    neighbours = [[(i - 1) % n, (i + 1) % n] for i in range(n)]
+    half_edges = [(i, (i + 1) % n) for i in range(n)]
+    for a, b in diagonals:
+        neighbours[a].append(b)
+        neighbours[b].append(a)
+        half_edges.append((a, b))
+        half_edges.append((b, a))
+    for i, ns in enumerate(neighbours):
+        x, y = points[i]
+        ns.sort(key=lambda j: math.atan2(points[j][1] - y, points[j][0] - x))
+    index = [{j: k for k, j in enumerate(ns)} for ns in neighbours]
+
+    visited = set()
+    faces = list()
+    for start in half_edges:
+        if start in visited:
+            continue
+        face = list()
+        u, v = start
+        while (u, v) not in visited:
+            visited.add((u, v))
+            face.append(u)
+            ns = neighbours[v]
+            # The next edge of the face is the first one clockwise from the
+            # edge we arrived on
+            u, v = v, ns[index[v][u] - 1]
+        faces.append(face)
+    return faces
+
+def _triangulate_monotone(points, face):
+    """Return the triangles (as index triples) of the y-monotone counter
+    clockwise polygon face"""
+    if len(face) == 3:
+        return [tuple(face)]
+    m = len(face)
+    top = min(range(m), key=lambda k: _height(points[face[k]]))
+    bottom = max(range(m), key=lambda k: _height(points[face[k]]))
+    # Going counter clockwise from the top goes down the left chain
+    left = set()
+    k = top
+    while k != bottom:
+        left.add(face[k])
+        k = (k + 1) % m
+    order = sorted(face, key=lambda i: _height(points[i]))
+
+    triangles = list()
+    stack = [order[0], order[1]]
+    for u in order[2:-1]:
+        if (u in left) != (stack[-1] in left):
+            # u is on the other chain to the top of the stack, so it can see
+            # every point on the stack
+            for a, b in zip(stack, stack[1:]):
+                triangles.append((u, a, b))
+            stack = [stack[-1], u]
+        else:
+            last = stack.pop()
+            while stack:
+                s = stack[-1]
+                if u in left:
+                    inside = _cross(points[s], points[last], points[u]) > 0
+                else:
+                    inside = _cross(points[u], points[last], points[s]) > 0
+                if not inside:
+                    break
+                triangles.append((s, last, u))
+                last = stack.pop()
+            stack.append(last)
+            stack.append(u)
+    u = order[-1]
+    for a, b in zip(stack, stack[1:]):
+        triangles.append((u, a, b))
+    return triangles
+
+def _incircle(a, b, c, d):
+    """Return a value > 0 if d is inside the circumcircle of the counter
+    clockwise triangle a, b, c"""
+    adx, ady = a[0] - d[0], a[1] - d[1]
+    bdx, bdy = b[0] - d[0], b[1] - d[1]
+    cdx, cdy = c[0] - d[0], c[1] - d[1]
+    return ((adx*adx + ady*ady) * (bdx*cdy - cdx*bdy)
+            - (bdx*bdx + bdy*bdy) * (adx*cdy - cdx*ady)
+            + (cdx*cdx + cdy*cdy) * (adx*bdy - bdx*ady))
+
+def _delaunay_flip(points, triangles):
+    """Flip diagonals of the triangulation until no triangle has a point of
+    its neighbour inside its circumcircle. Edges of the polygon are never
+    flipped.
+
+    Flipping n points to a Delaunay triangulation takes at most n^2 flips,
+    so the flipping stops there, in case rounding errors in the circle test
+    would flip the same diagonals back and forth.
+    """
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    size = max(max(xs) - min(xs), max(ys) - min(ys))
+    tolerance = 1e-10 * size**4
+
+    edges = dict()
+    for t, tri in enumerate(triangles):
+        for k in range(3):
+            a, b = tri[k], tri[(k + 1) % 3]
+            edges.setdefault((min(a, b), max(a, b)), []).append(t)
+    todo = [e for e, ts in edges.items() if len(ts) == 2]
+    flips = len(points) ** 2
+    while todo and flips > 0:
+        e = todo.pop()
+        ts = edges.get(e)
+        if ts is None or len(ts) != 2:
+            continue
+        t1, t2 = ts
+        # Rotate the triangles so that they are (a, b, c) and (b, a, d)
+        tri1, tri2 = triangles[t1], triangles[t2]
+        k = [i for i in range(3) if tri1[i] not in e][0]
+        c, a, b = tri1[k], tri1[(k + 1) % 3], tri1[(k + 2) % 3]
+        d = [i for i in tri2 if i not in e][0]
+        if _incircle(points[a], points[b], points[c], points[d]) <= tolerance:
+            continue
+        if (_cross(points[c], points[a], points[d]) <= 0
+                or _cross(points[d], points[b], points[c]) <= 0):
+            continue
+        triangles[t1] = (a, d, c)
+        triangles[t2] = (d, b, c)
+        flips -= 1
+        del edges[e]
+        edges[(min(c, d), max(c, d))] = [t1, t2]
+        ad = edges[(min(a, d), max(a, d))]
+        ad[ad.index(t2)] = t1
+        bc = edges[(min(b, c), max(b, c))]
+        bc[bc.index(t1)] = t2
+        for p, q in ((a, d), (d, b), (b, c), (c, a)):
+            todo.append((min(p, q), max(p, q)))
+    return triangles
+
+def triangulate_indices(polygon, improve=True):
+    """Triangulate a simple polygon.
+
+    Returns the cleaned up polygon (see _clean) and a list of counter
+    clockwise triples of indices into it. If improve is True the diagonals
+    are flipped to remove slivers. Raises ValueError if the polygon crosses
+    or touches itself or has no area.
+    """
+    points = _clean(polygon)
+    _check_simple(points)
+    triangles = list()
+    for face in _faces(points, _monotone_diagonals(points)):
+        for a, b, c in _triangulate_monotone(points, face):
+            if _cross(points[a], points[b], points[c]) < 0:
+                b, c = c, b
+            triangles.append((a, b, c))
+    if improve:
+        triangles = _delaunay_flip(points, triangles)
+    return points, triangles
+
+def triangulate(polygon, improve=True):
+    """Triangulate a simple polygon (a list of points in either order).
+
+    Returns a list of Triangles. If improve is True the diagonals are flipped
+    to remove slivers. Raises ValueError if the polygon is not simple.
+    """
+    points, triangles = triangulate_indices(polygon, improve)
+    return [Triangle(tuple(points[i] for i in t)) for t in triangles]
+
+def random_polygon(n, seed=0):
+    """Return a random star shaped (and usually very concave) polygon with n
+    points"""
+    import random
+    rng = random.Random(seed)
+    # Keeping every gap between angles below pi keeps the polygon simple
+    angles = [2 * math.pi * (i + rng.uniform(0, 0.5)) / n for i in range(n)]
+    return [(math.cos(a) * r, math.sin(a) * r)
+            for a, r in ((a, rng.uniform(500, 1000)) for a in angles)]
+
+def min_angle(triangle):
+    """Return the smallest angle of the triangle (in degrees)"""
+    return math.degrees(min(triangle.angle(i) for i in range(3)))
+
+if __name__ == '__main__':
+    import sys
+    import time
+    sizes = [int(s) for s in sys.argv[1:]] or [10**3, 10**4, 10**5]
+    print('%8s %10s %10s %12s %12s' % ('n', 'plain (s)', 'flip (s)',
+                                       'slivers', 'slivers flip'))
+    for n in sizes:
+        polygon = random_polygon(n)
+        start = time.perf_counter()
+        plain = triangulate(polygon, improve=False)
+        middle = time.perf_counter()
+        flipped = triangulate(polygon)
+        end = time.perf_counter()
+        assert len(plain) == len(flipped) == n - 2
+        slivers = sum(1 for t in plain if min_angle(t) < 5)
+        flipped_slivers = sum(1 for t in flipped if min_angle(t) < 5)
+        print('%8d %10.3f %10.3f %12d %12d' % (n, middle - start, end - middle,
+                                               slivers, flipped_slivers))